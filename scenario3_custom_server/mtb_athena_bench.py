@@ -0,0 +1,702 @@
+# scenario3_custom_server/mtb_athena_bench.py
+"""
+Micro-benchmarks for mtb_athena_server against a local stub Athena endpoint.
+
+No AWS account is needed: the stub speaks just enough of the Athena JSON
+protocol for the server helpers, and dummy credentials are injected.
+
+Usage:
+  python scenario3_custom_server/mtb_athena_bench.py client [--calls 200]
+  python scenario3_custom_server/mtb_athena_bench.py concurrency [--queries 8]
+  python scenario3_custom_server/mtb_athena_bench.py decode [--rows 100000]
+  python scenario3_custom_server/mtb_athena_bench.py s3 [--rows 50000]
+  python scenario3_custom_server/mtb_athena_bench.py search [--tables 5000]
+  python scenario3_custom_server/mtb_athena_bench.py scheduler [--queries 16]
+  python scenario3_custom_server/mtb_athena_bench.py batch [--queries 6]
+  python scenario3_custom_server/mtb_athena_bench.py sql [--calls 1000]
+  python scenario3_custom_server/mtb_athena_bench.py sample [--table-gb 50]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+
+# --------------------------------------------------------------------
+# Stub Athena endpoint
+# --------------------------------------------------------------------
+
+
+class _StubAthenaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so pooled clients can keep connections alive.
+    protocol_version = "HTTP/1.1"
+    # Avoid Nagle/delayed-ACK stalls between header and body writes.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # noqa: A002 - silence stderr
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        operation = self.headers.get("X-Amz-Target", "").split(".")[-1]
+
+        handler = getattr(self.server.backend, operation, None)
+        if handler is None:
+            self._reply(400, {"__type": "InvalidRequestException",
+                              "Message": f"Unsupported: {operation}"})
+            return
+        try:
+            self._reply(200, handler(body))
+        except _StubError as exc:
+            self._reply(400, {"__type": exc.code, "Message": str(exc)})
+
+    def do_GET(self):
+        # Path-style S3 GetObject: /<bucket>/<key>
+        data = self.server.backend.get_object(self.path.lstrip("/"))
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeAthena:
+    """
+    In-memory Athena backend: every query succeeds after `latency_sec`
+    and returns `rows` (header row first). Also answers Glue GetDatabases /
+    GetTables from
+    `tables` ({database: [Glue table dicts]}) and serves each query's result
+    CSV as s3://results/<QueryExecutionId>.csv. With `max_active`, starting
+    a query while that many are running fails with TooManyRequestsException,
+    like a workgroup at its active-query quota. Each query reports
+    `scan_bytes` scanned, scaled down by TABLESAMPLE SYSTEM.
+    """
+
+    def __init__(
+        self,
+        latency_sec: float = 0.0,
+        rows: List[List[str]] | None = None,
+        tables: Dict[str, List[Dict[str, Any]]] | None = None,
+        max_active: int | None = None,
+        scan_bytes: int = 0,
+    ):
+        self.latency_sec = latency_sec
+        self.rows = rows or [["col"], ["value"]]
+        self.tables = tables or {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.pages_served = 0
+        self.status_polls = 0
+        self.batch_polls = 0
+        self.max_active = max_active
+        self.scan_bytes = scan_bytes
+        self.throttled = 0
+        self.peak_active = 0
+        self._csv: bytes | None = None
+        self._lock = threading.Lock()
+
+    def _active(self, now: float) -> int:
+        return sum(
+            1 for q in self.queries.values()
+            if not q.get("cancelled") and now - q["started"] < self.latency_sec
+        )
+
+    def StartQueryExecution(self, body):
+        qid = str(uuid.uuid4())
+        with self._lock:
+            now = time.time()
+            active = self._active(now)
+            if self.max_active is not None and active >= self.max_active:
+                self.throttled += 1
+                raise _StubError(
+                    "TooManyRequestsException",
+                    "You have exceeded the limit for the number of queries you can run concurrently.",
+                )
+            self.queries[qid] = {"sql": body["QueryString"], "started": now}
+            self.peak_active = max(self.peak_active, active + 1)
+        return {"QueryExecutionId": qid}
+
+    def StopQueryExecution(self, body):
+        query = self.queries.get(body["QueryExecutionId"])
+        if query is not None:
+            query["cancelled"] = True
+        return {}
+
+    def _execution(self, qid: str) -> Dict[str, Any]:
+        query = self.queries.get(qid, {"sql": "", "started": 0.0})
+        done = time.time() - query["started"] >= self.latency_sec
+        stats = {
+            "TotalExecutionTimeInMillis": int(self.latency_sec * 1000),
+            "DataScannedInBytes": self._scanned(query["sql"]),
+        }
+        if query.get("cancelled"):
+            state = "CANCELLED"
+        else:
+            state = "SUCCEEDED" if done else "RUNNING"
+        return {
+            "QueryExecutionId": qid,
+            "Query": query["sql"],
+            "Status": {"State": state},
+            "Statistics": stats if done else {},
+            "StatementType": "DML",
+            "ResultConfiguration": {"OutputLocation": f"s3://results/{qid}.csv"},
+        }
+
+    def _scanned(self, sql: str) -> int:
+        sample = re.search(r"TABLESAMPLE\s+SYSTEM\s*\(\s*([\d.]+)\s*\)", sql, re.I)
+        return int(self.scan_bytes * (float(sample.group(1)) / 100 if sample else 1))
+
+    def GetQueryExecution(self, body):
+        self.status_polls += 1
+        return {"QueryExecution": self._execution(body["QueryExecutionId"])}
+
+    def BatchGetQueryExecution(self, body):
+        self.batch_polls += 1
+        return {
+            "QueryExecutions": [self._execution(qid) for qid in body["QueryExecutionIds"]],
+            "UnprocessedQueryExecutionIds": [],
+        }
+
+    def GetQueryResults(self, body):
+        # Header row first, then data; NextToken is simply the row offset.
+        offset = int(body.get("NextToken", "0"))
+        page = self.rows[offset:offset + body.get("MaxResults", 1000)]
+        self.pages_served += 1
+        result = {
+            "ResultSet": {
+                "Rows": [
+                    {"Data": [{"VarCharValue": v} for v in row]}
+                    for row in page
+                ],
+                "ResultSetMetadata": {
+                    "ColumnInfo": [
+                        {"Name": name, "Label": name, "Type": "varchar"}
+                        for name in self.rows[0]
+                    ]
+                },
+            }
+        }
+        if offset + len(page) < len(self.rows):
+            result["NextToken"] = str(offset + len(page))
+        return result
+
+
+    def GetTables(self, body):
+        tables = self.tables.get(body["DatabaseName"], [])
+        pattern = body.get("Expression")
+        if pattern:
+            tables = [t for t in tables if re.fullmatch(pattern, t["Name"])]
+        # Two tables per page to exercise pagination.
+        offset = int(body.get("NextToken", "0"))
+        result = {"TableList": tables[offset:offset + 2]}
+        if offset + 2 < len(tables):
+            result["NextToken"] = str(offset + 2)
+        return result
+
+
+    def GetDatabases(self, body):
+        return {"DatabaseList": [{"Name": name} for name in self.tables]}
+
+    def get_object(self, path: str) -> bytes | None:
+        bucket, _, key = path.partition("/")
+        if bucket != "results" or key[:-len(".csv")] not in self.queries:
+            return None
+        if self._csv is None:
+            # Athena style: every value quoted, NULL left empty.
+            self._csv = "".join(
+                ",".join("" if v is None else '"' + v.replace('"', '""') + '"' for v in row)
+                + "\n"
+                for row in self.rows
+            ).encode()
+        return self._csv
+
+
+class _StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients closing a stream early (S3 reads) reset the connection.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub(backend: FakeAthena) -> ThreadingHTTPServer:
+    """Serve `backend` on an ephemeral localhost port in a daemon thread."""
+    httpd = _StubServer(("127.0.0.1", 0), _StubAthenaHandler)
+    httpd.daemon_threads = True
+    httpd.backend = backend
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def _import_server(endpoint_url: str):
+    """Import the server module pointed at the stub endpoint."""
+    os.environ["MTB_ATHENA_ENDPOINT_URL"] = endpoint_url
+    os.environ["MTB_ATHENA_GLUE_ENDPOINT_URL"] = endpoint_url
+    os.environ["MTB_ATHENA_S3_ENDPOINT_URL"] = endpoint_url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.pop("AWS_SESSION_TOKEN", None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import mtb_athena_server
+
+    return mtb_athena_server
+
+
+def _timed(fn: Callable[[], Any], calls: int) -> List[float]:
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(label: str, samples: List[float]) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"  {label:<28} mean={statistics.mean(samples):7.2f}ms "
+        f"p50={statistics.median(samples):7.2f}ms p95={p95:7.2f}ms"
+    )
+
+
+# --------------------------------------------------------------------
+# Benchmarks
+# --------------------------------------------------------------------
+
+
+def bench_client(calls: int) -> None:
+    """Per-call overhead: fresh boto3 client per call vs the pooled client."""
+    import boto3
+
+    httpd = start_stub(FakeAthena())
+    endpoint = f"http://127.0.0.1:{httpd.server_address[1]}"
+    server = _import_server(endpoint)
+
+    def fresh_client_call():
+        client = boto3.client(
+            "athena", region_name=server.AWS_REGION, endpoint_url=endpoint
+        )
+        client.get_query_execution(QueryExecutionId="bench")
+
+    def pooled_client_call():
+        server.get_athena_client().get_query_execution(QueryExecutionId="bench")
+
+    pooled_client_call()  # build the shared client outside the timing loop
+
+    print(f"get_query_execution x{calls} against {endpoint}")
+    _report("before (client per call)", _timed(fresh_client_call, calls))
+    _report("after (pooled client)", _timed(pooled_client_call, calls))
+    httpd.shutdown()
+
+
+def bench_concurrency(queries: int, latency_sec: float) -> None:
+    """
+    N concurrent run_readonly_query calls against a fake backend where every
+    query takes `latency_sec`. Non-blocking tools finish in ~max(latency),
+    and the event loop stays responsive meanwhile. Exits 1 otherwise.
+    """
+    httpd = start_stub(FakeAthena(latency_sec=latency_sec))
+    server = _import_server(f"http://127.0.0.1:{httpd.server_address[1]}")
+    server.PREFLIGHT_EXPLAIN = False  # one query per call: measure overlap only
+
+    async def heartbeat(stop: asyncio.Event, lags: List[float]) -> None:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - t0 - 0.01)
+
+    async def run() -> tuple[float, float]:
+        stop, lags = asyncio.Event(), []
+        beat = asyncio.create_task(heartbeat(stop, lags))
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            server.run_readonly_query("bench", f"SELECT {i}", max_rows=5)
+            for i in range(queries)
+        ))
+        wall = time.perf_counter() - t0
+        stop.set()
+        await beat
+        return wall, max(lags, default=0.0)
+
+    wall, max_lag = asyncio.run(run())
+    print(
+        f"{queries} concurrent queries x {latency_sec:.2f}s latency: "
+        f"wall={wall:.2f}s (sum={queries * latency_sec:.2f}s, "
+        f"max={latency_sec:.2f}s), worst event-loop lag={max_lag * 1000:.1f}ms"
+    )
+    httpd.shutdown()
+    if wall > latency_sec * 1.5 + 0.5 or max_lag > 0.25:
+        print("FAIL: tool calls are serialized or block the event loop")
+        sys.exit(1)
+    print("OK: concurrent tool calls overlap")
+
+
+def _synthetic_result(rows: int):
+    """ColumnInfo + VarCharValue rows shaped like a transactions extract."""
+    column_info = [
+        {"Name": "id", "Type": "bigint"},
+        {"Name": "amount", "Type": "decimal"},
+        {"Name": "rate", "Type": "double"},
+        {"Name": "description", "Type": "varchar"},
+        {"Name": "is_pending", "Type": "boolean"},
+        {"Name": "date", "Type": "date"},
+        {"Name": "created_at", "Type": "timestamp"},
+        {"Name": "created_unix", "Type": "bigint"},
+    ]
+    data = [
+        [
+            str(i), f"{i % 9973}.25", f"{i / 7:.6f}", f"wifi charge {i}",
+            "true" if i % 2 else "false", "2024-05-01",
+            "2024-05-01 12:34:56.789", str(1714566896 + i),
+        ] if i % 50 else [str(i), None, None, None, None, None, None, None]
+        for i in range(rows)
+    ]
+    return column_info, data
+
+
+def bench_decode(rows: int) -> None:
+    """Row-by-row per-cell decoding vs column-wise decoding of a result."""
+    server = _import_server("http://127.0.0.1:9")
+    column_info, data = _synthetic_result(rows)
+    names = server._column_names(column_info)
+
+    def strings_only():
+        return [dict(zip(names, r)) for r in data]
+
+    def row_by_row():
+        out = []
+        for r in data:
+            record = {}
+            for info, name, value in zip(column_info, names, r):
+                decoder = server._column_decoder(info["Type"])
+                record[name] = decoder(value) if decoder else value
+            out.append(record)
+        return out
+
+    def column_wise():
+        return server._shape_result(data, column_info, typed=True, columnar=False)
+
+    def column_wise_columnar():
+        return server._shape_result(data, column_info, typed=True, columnar=True)
+
+    assert row_by_row() == column_wise()
+    print(f"decode {rows} rows x {len(names)} columns")
+    _report("strings only (no decode)", _timed(strings_only, 5))
+    _report("typed, row by row", _timed(row_by_row, 5))
+    _report("typed, column-wise", _timed(column_wise, 5))
+    _report("typed, column-wise columnar", _timed(column_wise_columnar, 5))
+
+
+def bench_s3(rows: int) -> None:
+    """Fetching a large result: GetQueryResults pages vs streaming the S3 CSV."""
+    column_info, data = _synthetic_result(rows)
+    header = [c["Name"] for c in column_info]
+    httpd = start_stub(FakeAthena(rows=[header] + data))
+    server = _import_server(f"http://127.0.0.1:{httpd.server_address[1]}")
+
+    async def run_query():
+        qid = await server._start_query("bench", "SELECT * FROM bench")
+        return qid, await server._wait_for_query(qid)
+
+    qid, wait_stats = asyncio.run(run_query())
+    location = wait_stats["output_location"]
+
+    api_rows, _ = server._fetch_rows(qid, rows)
+    s3_rows, _ = server._fetch_rows_s3(qid, location, rows)
+    assert len(api_rows) == len(s3_rows) == rows
+
+    print(f"fetch {rows} rows x {len(header)} columns")
+    _report("GetQueryResults pages", _timed(lambda: server._fetch_rows(qid, rows), 3))
+    _report("S3 CSV stream", _timed(lambda: server._fetch_rows_s3(qid, location, rows), 3))
+    httpd.shutdown()
+
+
+def bench_search(tables: int) -> None:
+    """search_schema index lookups vs a linear scan of the catalog."""
+    server = _import_server("http://127.0.0.1:9")
+    words = ["account", "user", "guest", "merchant", "amount", "status", "created",
+             "institution", "credential", "subscription", "currency", "balance"]
+    catalog: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for t in range(tables):
+        db = f"db_{t % 10}"
+        columns = [
+            {"name": f"{words[(t + c) % len(words)]}_{c}", "type": "varchar",
+             "comment": f"{words[(t * c) % len(words)]} field", "partition_key": False}
+            for c in range(30)
+        ]
+        if t % 100 == 0:  # a rare concept, like most real searches
+            columns.append({"name": "monthly_salary", "type": "decimal(12,2)",
+                            "comment": "gross salary", "partition_key": False})
+        catalog.setdefault(db, {})[f"{words[t % len(words)]}_table_{t}"] = columns
+
+    index = server._SchemaIndex()
+    started = time.perf_counter()
+    for db, db_tables in catalog.items():
+        index.update(db, db_tables)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def linear_scan(term: str) -> int:
+        return sum(
+            term in f"{col['name']} {col['type']} {col['comment']}".lower()
+            for db_tables in catalog.values()
+            for columns in db_tables.values()
+            for col in columns
+        )
+
+    # Re-index one database after a single table changed.
+    changed = dict(catalog["db_0"])
+    name = next(iter(changed))
+    changed[name] = changed[name] + [{"name": "new_col", "type": "int", "comment": ""}]
+    started = time.perf_counter()
+    index.update("db_0", changed)
+    update_ms = (time.perf_counter() - started) * 1000
+
+    print(f"search {tables} tables x 30 columns; full build {build_ms:.0f} ms, "
+          f"incremental update of 1 table {update_ms:.2f} ms")
+    _report("linear scan 'salary'", _timed(lambda: linear_scan("salary"), 20))
+    _report("index 'salary' (token)", _timed(lambda: index.search("salary", None, 50), 20))
+    _report("index 'alar' (substring)", _timed(lambda: index.search("alar", None, 50), 20))
+    _report("index 'salery' (fuzzy)", _timed(lambda: index.search("salery", None, 50), 20))
+    _report("index 'amount' (common)", _timed(lambda: index.search("amount", None, 50), 20))
+
+
+def bench_scheduler(queries: int) -> None:
+    """
+    A burst of heavy queries against a workgroup that allows 4 running
+    queries, then one metadata query: without the scheduler the burst hits
+    TooManyRequestsException and retries; with it, queries queue under the
+    cap and the metadata query jumps the queue.
+    """
+    latency = 0.3
+    backend = FakeAthena(latency_sec=latency, max_active=4)
+    httpd = start_stub(backend)
+    server = _import_server(f"http://127.0.0.1:{httpd.server_address[1]}")
+    server.PREFLIGHT_EXPLAIN = False
+    server.THROTTLE_BASE_SEC = 0.05
+
+    async def burst(tag: str) -> tuple[float, float]:
+        t0 = time.perf_counter()
+        heavy = [
+            asyncio.create_task(server._run_query(
+                "bench", f"SELECT {tag}{i}", priority=server.PRIORITY_BULK
+            ))
+            for i in range(queries)
+        ]
+        await asyncio.sleep(0.05)
+        m0 = time.perf_counter()
+        await server._run_query("bench", f"SHOW TABLES IN {tag}")
+        metadata_sec = time.perf_counter() - m0
+        await asyncio.gather(*heavy)
+        return time.perf_counter() - t0, metadata_sec
+
+    print(f"{queries} heavy queries x {latency:.2f}s + 1 metadata query, workgroup quota 4")
+    for label, cap in (("no scheduler", 0), ("scheduler (cap 4)", 4)):
+        server._scheduler.max_concurrent = cap
+        backend.throttled, backend.peak_active = 0, 0
+        wall, metadata_sec = asyncio.run(burst(label.split()[0]))
+        print(
+            f"  {label:<20} wall={wall:.2f}s metadata query={metadata_sec:.2f}s "
+            f"throttled starts={backend.throttled} peak running={backend.peak_active}"
+        )
+    httpd.shutdown()
+
+
+def bench_batch(queries: int) -> None:
+    """
+    N comparative queries issued one after another (run_readonly_query per
+    query) vs together (run_readonly_queries, polled via
+    BatchGetQueryExecution).
+    """
+    latency = 0.5
+    backend = FakeAthena(latency_sec=latency, rows=[["n"], ["1"]])
+    httpd = start_stub(backend)
+    server = _import_server(f"http://127.0.0.1:{httpd.server_address[1]}")
+    server.PREFLIGHT_EXPLAIN = False
+
+    async def sequential():
+        for i in range(queries):
+            await server.run_readonly_query("bench", f"SELECT {i} AS n", use_cache=False)
+
+    async def batched():
+        result = await server.run_readonly_queries(
+            "bench", [f"SELECT {i} AS n, 'batch'" for i in range(queries)], use_cache=False
+        )
+        assert not result["meta"]["failed"], result
+
+    print(f"{queries} queries x {latency:.2f}s latency")
+    for label, run in (("sequential", sequential), ("run_readonly_queries", batched)):
+        backend.status_polls = backend.batch_polls = 0
+        t0 = time.perf_counter()
+        asyncio.run(run())
+        wall = time.perf_counter() - t0
+        print(
+            f"  {label:<22} wall={wall:.2f}s GetQueryExecution={backend.status_polls} "
+            f"BatchGetQueryExecution={backend.batch_polls}"
+        )
+    httpd.shutdown()
+
+
+def bench_sql(calls: int) -> None:
+    """
+    One parse of a typical agent query (safety check, tables, LIMIT,
+    cache key, fingerprint) vs the memoized lookup for repeated SQL.
+    """
+    server = _import_server("http://127.0.0.1:9")
+    sql = """
+        WITH recent AS (
+            SELECT account_id, amount, description_guest
+            FROM transactions
+            WHERE date >= date_add('day', -30, current_date)
+        )
+        SELECT a.institution_id, count(*) AS n, sum(r.amount) AS total
+        FROM recent r
+        JOIN accounts a ON a.account_id = r.account_id
+        WHERE lower(r.description_guest) LIKE '%wifi%'
+          AND r.description_guest NOT LIKE '%update%'
+        GROUP BY 1
+        ORDER BY n DESC
+    """
+    analysis = server._analyze_sql(sql)
+    print(
+        f"safe={analysis.error is None} tables="
+        f"{[ref.table for ref in analysis.tables]} fingerprint={analysis.fingerprint}"
+    )
+    _report("parse (uncached)", _timed(lambda: server._analyze_sql.__wrapped__(sql), calls))
+    _report("memoized", _timed(lambda: server._analyze_sql(sql), calls))
+
+
+def bench_sample(table_gb: float) -> None:
+    """
+    Bytes scanned by an exploratory "show me some wifi transactions" query:
+    full scan vs TABLESAMPLE SYSTEM at a few percentages, and auto mode.
+    """
+    size = int(table_gb * 1024 ** 3)
+    table = {
+        "Name": "transactions",
+        "StorageDescriptor": {
+            "Columns": [{"Name": "id", "Type": "bigint"},
+                        {"Name": "description_guest", "Type": "string"}],
+        },
+        "Parameters": {"sizeKey": str(size), "classification": "csv"},
+    }
+    backend = FakeAthena(
+        latency_sec=0.05, rows=[["id"], ["1"], ["2"]],
+        tables={"bench": [table]}, scan_bytes=size,
+    )
+    httpd = start_stub(backend)
+    os.environ["MTB_ATHENA_SCHEMA_SNAPSHOT"] = ""
+    server = _import_server(f"http://127.0.0.1:{httpd.server_address[1]}")
+    server.PREFLIGHT_EXPLAIN = False
+    server._scan_budget.budget_bytes = 0
+    sql = (
+        "SELECT id, description_guest FROM transactions "
+        "WHERE lower(description_guest) LIKE '%wifi%'"
+    )
+
+    async def run(**kwargs) -> Dict[str, Any]:
+        result = await server.run_readonly_query(
+            "bench", sql, max_rows=5, use_cache=False, allow_large_scan=True, **kwargs
+        )
+        return result["meta"]
+
+    print(f"exploratory query on a {table_gb:g} GB table")
+    full = asyncio.run(run())["data_scanned_bytes"]
+    print(f"  {'full scan':<22} scanned={server._format_bytes(full):>9}")
+    for pct in (10, 1):
+        meta = asyncio.run(run(sample_pct=pct))
+        print(
+            f"  {f'sample_pct={pct}':<22} scanned={server._format_bytes(meta['data_scanned_bytes']):>9} "
+            f"(-{100 * (1 - meta['data_scanned_bytes'] / full):.0f}%) "
+            f"estimate={server._format_bytes(meta['scan_estimate_bytes'])}"
+        )
+    server.AUTO_SAMPLE_PCT = 5
+    meta = asyncio.run(run())
+    print(
+        f"  {'auto (5%)':<22} scanned={server._format_bytes(meta['data_scanned_bytes']):>9} "
+        f"sampled={'sampled' in meta}"
+    )
+    httpd.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_client = sub.add_parser("client", help="client construction overhead")
+    p_client.add_argument("--calls", type=int, default=200)
+
+    p_conc = sub.add_parser("concurrency", help="concurrent tool calls")
+    p_conc.add_argument("--queries", type=int, default=8)
+    p_conc.add_argument("--latency", type=float, default=1.0)
+
+    p_decode = sub.add_parser("decode", help="typed result decoding")
+    p_decode.add_argument("--rows", type=int, default=100_000)
+
+    p_s3 = sub.add_parser("s3", help="S3 result-file streaming")
+    p_s3.add_argument("--rows", type=int, default=50_000)
+
+    p_search = sub.add_parser("search", help="schema search index")
+    p_search.add_argument("--tables", type=int, default=5000)
+
+    p_sched = sub.add_parser("scheduler", help="workgroup query scheduler")
+    p_sched.add_argument("--queries", type=int, default=16)
+
+    p_batch = sub.add_parser("batch", help="concurrent batch of queries")
+    p_batch.add_argument("--queries", type=int, default=6)
+
+    p_sql = sub.add_parser("sql", help="SQL analysis and its memoization")
+    p_sql.add_argument("--calls", type=int, default=1000)
+
+    p_sample = sub.add_parser("sample", help="TABLESAMPLE scan reduction")
+    p_sample.add_argument("--table-gb", type=float, default=50)
+
+    args = parser.parse_args()
+    if args.bench == "client":
+        bench_client(args.calls)
+    elif args.bench == "concurrency":
+        bench_concurrency(args.queries, args.latency)
+    elif args.bench == "decode":
+        bench_decode(args.rows)
+    elif args.bench == "s3":
+        bench_s3(args.rows)
+    elif args.bench == "search":
+        bench_search(args.tables)
+    elif args.bench == "scheduler":
+        bench_scheduler(args.queries)
+    elif args.bench == "batch":
+        bench_batch(args.queries)
+    elif args.bench == "sql":
+        bench_sql(args.calls)
+    elif args.bench == "sample":
+        bench_sample(args.table_gb)
+
+
+if __name__ == "__main__":
+    main()
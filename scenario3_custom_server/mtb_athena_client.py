@@ -90,14 +90,16 @@ async def main() -> None:
                     "max_rows": 5,
                 },
             )
-            rows_payload = _unwrap_call_tool_result(rows_result)
-            rows: List[Dict[str, Any]] = rows_payload.get("result", [])
+            rows_payload = _unwrap_call_tool_result(rows_result).get("result", {})
+            rows: List[Dict[str, Any]] = rows_payload.get("rows", [])
+            meta: Dict[str, Any] = rows_payload.get("meta", {})
 
             if not rows:
                 print("Got 0 rows.")
             else:
                 print(f"Got {len(rows)} row(s):\n")
                 print(json.dumps(rows, indent=2, ensure_ascii=False))
+            print(f"\nQuery meta: {json.dumps(meta, ensure_ascii=False)}")
 
             print("\n✅ Done. MCP + Athena is working 🎉")
 
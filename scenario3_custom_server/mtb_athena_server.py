@@ -3,19 +3,64 @@
 MCP server exposing read-only Athena tools for Hackdays.
 
 Tools:
-  - list_tables(database=None)
-  - describe_table(database, table)
-  - run_readonly_query(database, sql, max_rows=50)
+  - list_tables(database=None, reuse_max_age_minutes=None)
+  - describe_table(database, table, reuse_max_age_minutes=None)
+  - describe_tables(database, tables)
+  - search_schema(pattern, database=None, max_results=50)
+  - run_readonly_query(database, sql, max_rows=50, use_cache=True,
+                       reuse_max_age_minutes=None, typed=True, columnar=False,
+                       allow_large_scan=False, limit_pushdown=True,
+                       sample_pct=None)
+  - run_readonly_queries(database, queries, max_rows=50, use_cache=True,
+                         typed=True, columnar=False, limit_pushdown=True,
+                         sample_pct=None)
+  - fetch_more(cursor, n=50)
+  - start_query(database, sql, reuse_max_age_minutes=None, allow_large_scan=False)
+  - query_status(job_id, wait_sec=0)
+  - fetch_results(job_id, max_rows=50, next_token=None, typed=True, columnar=False)
+  - export_query_parquet(database, sql, preview_rows=20, columns=None)
+  - get_server_metrics()
 """
 
-from typing import List, Dict, Any
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Callable, Iterator, NamedTuple
+import asyncio
+import atexit
+import codecs
+import contextlib
+import contextvars
+import csv
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import math
 import os
+import random
 import re
+import signal
+import sys
+import threading
 import time
+import uuid
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from mcp.server.fastmcp import FastMCP
 
+try:  # optional: only needed by export_query_parquet
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
 # --------------------------------------------------------------------
 # Configuration
 # --------------------------------------------------------------------
@@ -38,9 +83,134 @@ DEFAULT_DATABASE = os.getenv(
     # or: "lakehouse_experimental_jp_production",
 )
 
+# Where list_tables/describe_table read metadata: "glue" (Data Catalog API)
+# or "athena" (SHOW TABLES / DESCRIBE queries)
+METADATA_BACKEND = os.getenv("MTB_ATHENA_METADATA_BACKEND", "glue").lower()
+
+# Schema cache for the Glue backend: entries older than the TTL are served
+# stale while refreshed in the background, up to MAX_STALE; the snapshot
+# file lets a fresh server process answer metadata calls immediately.
+SCHEMA_TTL_SEC = float(os.getenv("MTB_ATHENA_SCHEMA_TTL_SEC", "300"))
+SCHEMA_MAX_STALE_SEC = float(os.getenv("MTB_ATHENA_SCHEMA_MAX_STALE_SEC", "604800"))
+SCHEMA_SNAPSHOT_PATH = os.getenv(
+    "MTB_ATHENA_SCHEMA_SNAPSHOT",
+    os.path.join(os.path.expanduser("~"), ".cache", "mtb_athena", "schema_snapshot.json"),
+)
+# Glue database sweeps running at once (on their own threads, so a
+# catalog-wide search_schema never starves query polling and result I/O)
+SCHEMA_FETCH_CONCURRENCY = int(os.getenv("MTB_ATHENA_SCHEMA_FETCH_CONCURRENCY", "4"))
+
+# Scratch prefix for export_query_parquet (UNLOAD ... TO <prefix>/<uuid>/)
+UNLOAD_LOCATION = os.getenv(
+    "MTB_ATHENA_UNLOAD_LOCATION",
+    ATHENA_OUTPUT_LOCATION.rstrip("/") + "/unload/",
+)
+
 # Configurable timeout (seconds)
 DEFAULT_QUERY_TIMEOUT_SEC = int(os.getenv("MTB_ATHENA_QUERY_TIMEOUT_SEC", "180"))
 
+# Shared AWS client tuning
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+ATHENA_ENDPOINT_URL = os.getenv("MTB_ATHENA_ENDPOINT_URL") or None
+ATHENA_MAX_POOL_CONNECTIONS = int(os.getenv("MTB_ATHENA_MAX_POOL_CONNECTIONS", "32"))
+ATHENA_RETRY_MODE = os.getenv("MTB_ATHENA_RETRY_MODE", "adaptive")
+ATHENA_MAX_RETRY_ATTEMPTS = int(os.getenv("MTB_ATHENA_MAX_RETRY_ATTEMPTS", "5"))
+ATHENA_CONNECT_TIMEOUT_SEC = float(os.getenv("MTB_ATHENA_CONNECT_TIMEOUT_SEC", "5"))
+ATHENA_READ_TIMEOUT_SEC = float(os.getenv("MTB_ATHENA_READ_TIMEOUT_SEC", "60"))
+
+# Query status polling (exponential backoff with jitter)
+POLL_INITIAL_SEC = float(os.getenv("MTB_ATHENA_POLL_INITIAL_SEC", "0.05"))
+POLL_MAX_SEC = float(os.getenv("MTB_ATHENA_POLL_MAX_SEC", "5"))
+POLL_BACKOFF = float(os.getenv("MTB_ATHENA_POLL_BACKOFF", "1.6"))
+
+# Threads available for blocking AWS calls (keeps the MCP event loop free)
+MAX_IO_WORKERS = int(os.getenv("MTB_ATHENA_MAX_IO_WORKERS", "16"))
+
+# Scheduler: queries running at once per workgroup (stay under the
+# workgroup's active-query quota; extra queries wait, metadata first), and
+# application-level retries of throttled Athena calls with decorrelated jitter
+MAX_CONCURRENT_QUERIES = int(os.getenv("MTB_ATHENA_MAX_CONCURRENT_QUERIES", "10"))
+HEAVY_SCAN_BYTES = int(float(os.getenv("MTB_ATHENA_HEAVY_SCAN_GB", "1")) * 1024 ** 3)
+THROTTLE_MAX_RETRIES = int(os.getenv("MTB_ATHENA_THROTTLE_MAX_RETRIES", "6"))
+THROTTLE_BASE_SEC = float(os.getenv("MTB_ATHENA_THROTTLE_BASE_SEC", "0.5"))
+THROTTLE_MAX_SEC = float(os.getenv("MTB_ATHENA_THROTTLE_MAX_SEC", "20"))
+
+# start_query jobs: finished jobs are kept this long, and at most this many
+# jobs are tracked (running jobs are never evicted)
+JOB_TTL_SEC = float(os.getenv("MTB_ATHENA_JOB_TTL_SEC", "3600"))
+MAX_JOBS = int(os.getenv("MTB_ATHENA_MAX_JOBS", "100"))
+
+# Result paging: GetQueryResults returns at most 1000 rows per call
+RESULT_PAGE_SIZE = 1000
+RESULT_PREFETCH = os.getenv("MTB_ATHENA_RESULT_PREFETCH", "1") == "1"
+
+# Large SELECT results are streamed from the CSV Athena wrote to S3 instead
+# of paged through GetQueryResults (0 disables)
+S3_FASTPATH_MIN_ROWS = int(os.getenv("MTB_ATHENA_S3_FASTPATH_MIN_ROWS", "1000"))
+S3_READ_CHUNK_BYTES = int(os.getenv("MTB_ATHENA_S3_READ_CHUNK_BYTES", str(1024 * 1024)))
+
+# In-process result cache for run_readonly_query (0 disables)
+RESULT_CACHE_MAX_BYTES = int(
+    float(os.getenv("MTB_ATHENA_RESULT_CACHE_MB", "64")) * 1024 * 1024
+)
+RESULT_CACHE_TTL_SEC = float(os.getenv("MTB_ATHENA_RESULT_CACHE_TTL_SEC", "600"))
+
+# Cursors over truncated results (fetch_more): evicted after this idle time
+# and least-recently-used first beyond the memory budget
+CURSOR_IDLE_TTL_SEC = float(os.getenv("MTB_ATHENA_CURSOR_IDLE_TTL_SEC", "900"))
+CURSOR_MAX_BYTES = int(float(os.getenv("MTB_ATHENA_CURSOR_CACHE_MB", "4")) * 1024 * 1024)
+
+# Rewrite queries to LIMIT max(max_rows, LIMIT_PUSHDOWN_ROWS) + 1 before
+# submitting them (0 = never); fetch_more can page up to that many rows
+LIMIT_PUSHDOWN = os.getenv("MTB_ATHENA_LIMIT_PUSHDOWN", "1") == "1"
+LIMIT_PUSHDOWN_ROWS = int(os.getenv("MTB_ATHENA_LIMIT_PUSHDOWN_ROWS", "1000"))
+
+# Athena-side result reuse: max age (minutes) per tool, 0 disables
+RESULT_REUSE_MAX_AGE_MIN = {
+    "list_tables": int(os.getenv("MTB_ATHENA_REUSE_LIST_TABLES_MIN", "60")),
+    "describe_table": int(os.getenv("MTB_ATHENA_REUSE_DESCRIBE_TABLE_MIN", "60")),
+    "run_readonly_query": int(os.getenv("MTB_ATHENA_REUSE_QUERY_MIN", "15")),
+}
+RESULT_REUSE_MAX_AGE_LIMIT_MIN = 10080  # Athena's upper bound (7 days)
+
+# Scan guard: queries are estimated before they run (query history, Glue
+# table size statistics, then optionally EXPLAIN (TYPE IO)); estimates above
+# the per-query limit are rejected (or only warned about with action "warn"),
+# and the bytes Athena actually scanned are charged to a per-session budget
+# (0 disables). PREFLIGHT_EXPLAIN costs every new query shape without Glue
+# size stats (e.g. Iceberg tables) an extra Athena round-trip and query slot
+_GB = 1024 ** 3
+MAX_QUERY_SCAN_BYTES = int(float(os.getenv("MTB_ATHENA_MAX_QUERY_SCAN_GB", "10")) * _GB)
+SESSION_SCAN_BUDGET_BYTES = int(
+    float(os.getenv("MTB_ATHENA_SESSION_SCAN_BUDGET_GB", "100")) * _GB
+)
+SCAN_LIMIT_ACTION = os.getenv("MTB_ATHENA_SCAN_LIMIT_ACTION", "reject").lower()
+PREFLIGHT_EXPLAIN = os.getenv("MTB_ATHENA_PREFLIGHT_EXPLAIN", "0") == "1"
+
+# Partition pruning guard for queries on partitioned tables that never
+# filter on a partition key: warn | derive (add predicates from time filters)
+# | reject | off; string date partitions are assumed to use this format
+PARTITION_GUARD = os.getenv("MTB_ATHENA_PARTITION_GUARD", "warn").lower()
+PARTITION_DATE_FORMAT = os.getenv("MTB_ATHENA_PARTITION_DATE_FORMAT", "%Y-%m-%d")
+
+# Sampling: run_readonly_query(sample_pct=...) reads the largest table through
+# TABLESAMPLE; with AUTO_SAMPLE_PCT > 0, exploratory single-table queries on
+# tables of at least MTB_ATHENA_AUTO_SAMPLE_MIN_GB are sampled automatically.
+# SYSTEM skips whole files (less scanned); BERNOULLI reads everything
+AUTO_SAMPLE_PCT = float(os.getenv("MTB_ATHENA_AUTO_SAMPLE_PCT", "0"))
+AUTO_SAMPLE_MIN_BYTES = int(float(os.getenv("MTB_ATHENA_AUTO_SAMPLE_MIN_GB", "1")) * _GB)
+SAMPLE_METHOD = os.getenv("MTB_ATHENA_SAMPLE_METHOD", "system").lower()
+
+# Metrics exposition in Prometheus text format: a file rewritten every
+# interval (node_exporter textfile collector) and/or an HTTP /metrics
+# endpoint on localhost (unset / 0 disables)
+METRICS_FILE = os.getenv("MTB_ATHENA_METRICS_FILE", "")
+METRICS_FILE_INTERVAL_SEC = float(os.getenv("MTB_ATHENA_METRICS_FILE_INTERVAL_SEC", "15"))
+METRICS_PORT = int(os.getenv("MTB_ATHENA_METRICS_PORT", "0"))
+
+# Diagnostics go to stderr: stdout carries the MCP JSON-RPC stream
+LOG_LEVEL = os.getenv("MTB_ATHENA_LOG_LEVEL", "INFO").upper()
+
 # --------------------------------------------------------------------
 # Global MCP client
 # --------------------------------------------------------------------
@@ -48,206 +218,3917 @@ DEFAULT_QUERY_TIMEOUT_SEC = int(os.getenv("MTB_ATHENA_QUERY_TIMEOUT_SEC", "180")
 mcp = FastMCP("mtb_athena")
 
 # --------------------------------------------------------------------
-# Helpers
+# Logging
 # --------------------------------------------------------------------
 
-def get_athena_client():
-    """Get Athena client with proper region configuration."""
-    region = os.getenv("AWS_REGION", "ap-northeast-1")
-    return boto3.client("athena", region_name=region)
 
+def _stderr_logger() -> logging.Logger:
+    logger = logging.getLogger("mtb_athena")
+    logger.setLevel(LOG_LEVEL)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("[mtb_athena] %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
 
-def _wait_for_query(query_id: str, timeout_sec: int | None = None) -> None:
-    """
-    Poll Athena until query is SUCCEEDED or FAILED/CANCELLED.
 
-    Raises:
-        RuntimeError on FAILED/CANCELLED
-        TimeoutError on timeout
+_log = _stderr_logger()
+
+# --------------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------------
+
+
+class _Metrics:
+    """
+    Thread-safe counters, gauges and summaries keyed by metric name +
+    labels. Summaries keep count/sum plus a sliding window of recent samples
+    for quantiles.
     """
-    timeout = timeout_sec or DEFAULT_QUERY_TIMEOUT_SEC
-    start = time.time()
 
-    while True:
-        resp = get_athena_client().get_query_execution(QueryExecutionId=query_id)
-        status = resp["QueryExecution"]["Status"]
-        state = status["State"]
+    SUMMARY_WINDOW = 1024
+    QUANTILES = (0.5, 0.95, 0.99)
 
-        if state == "SUCCEEDED":
-            return
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+        self._summaries: Dict[tuple, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
 
-        if state in ("FAILED", "CANCELLED"):
-            reason = status.get("StateChangeReason", "Unknown")
-            raise RuntimeError(
-                f"Athena query {state}. "
-                f"QueryExecutionId={query_id}. Reason={reason}"
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "window": deque(maxlen=self.SUMMARY_WINDOW),
+                }
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["window"].append(value)
+
+    def _samples(self) -> List[tuple[str, str, tuple, float]]:
+        """(metric type, sample name, labels, value) for every series, sorted."""
+        with self._lock:
+            values = list(self._values.items())
+            summaries = [
+                (key, s["count"], s["sum"], sorted(s["window"]))
+                for key, s in self._summaries.items()
+            ]
+        samples = [
+            ("counter" if name.endswith("_total") else "gauge", name, labels, value)
+            for (name, labels), value in values
+        ]
+        for (name, labels), count, total, window in summaries:
+            for q in self.QUANTILES:
+                value = window[min(int(q * len(window)), len(window) - 1)]
+                samples.append(("summary", name, labels + (("quantile", str(q)),), value))
+            samples.append(("summary", f"{name}_count", labels, count))
+            samples.append(("summary", f"{name}_sum", labels, total))
+        return sorted(samples, key=lambda s: (s[1], s[2]))
+
+    def snapshot(self) -> Dict[str, float]:
+        """Flat {'name{label="v"}': value} view, sorted by name."""
+        out: Dict[str, float] = {}
+        for _, name, labels, value in self._samples():
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            out[f"{name}{{{label_text}}}" if labels else name] = value
+        return out
+
+    def prometheus_text(self, prefix: str = "mtb_") -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        typed: set[str] = set()
+        for kind, name, labels, value in self._samples():
+            family = name
+            if kind == "summary":
+                family = re.sub(r"_(count|sum)$", "", name)
+            if family not in typed:
+                typed.add(family)
+                lines.append(f"# TYPE {prefix}{family} {kind}")
+            label_text = ",".join(
+                '{}="{}"'.format(
+                    k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                )
+                for k, v in labels
+            )
+            lines.append(
+                f"{prefix}{name}{{{label_text}}} {value}" if labels else f"{prefix}{name} {value}"
             )
+        return "\n".join(lines) + "\n"
+
+
+_metrics = _Metrics()
 
-        if time.time() - start > timeout:
-            raise TimeoutError(
-                f"Athena query timed out after {timeout}s "
-                f"(QueryExecutionId={query_id})"
+# Name of the MCP tool the current task is serving (labels per-tool metrics).
+_current_tool: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "mtb_athena_tool", default=""
+)
+
+
+def _instrumented(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Record duration and outcome of every call of an async MCP tool."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _current_tool.set(fn.__name__)
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            result = await fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            _metrics.observe(
+                "tool_call_duration_ms", (time.monotonic() - started) * 1000, tool=fn.__name__
             )
+            _metrics.inc("tool_calls_total", tool=fn.__name__, outcome=outcome)
+            _current_tool.reset(token)
+
+    return wrapper
+
+
+def _write_metrics_file(path: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_metrics.prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        _log.warning("could not write metrics file: %s", exc)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002 - keep stdio clean
+        pass
+
+
+def _start_metrics_exporters() -> None:
+    """Start the configured metrics file writer / HTTP endpoint (daemon threads)."""
+    if METRICS_FILE:
+        def write_periodically():
+            while True:
+                _write_metrics_file(METRICS_FILE)
+                time.sleep(METRICS_FILE_INTERVAL_SEC)
+
+        threading.Thread(
+            target=write_periodically, name="mtb_athena_metrics_file", daemon=True
+        ).start()
+        atexit.register(_write_metrics_file, METRICS_FILE)
+        _log.info("writing metrics to %s", METRICS_FILE)
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), _MetricsHandler)
+        threading.Thread(
+            target=server.serve_forever, name="mtb_athena_metrics_http", daemon=True
+        ).start()
+        _log.info("metrics on http://127.0.0.1:%d/metrics", METRICS_PORT)
+
+# --------------------------------------------------------------------
+# Shared AWS clients
+# --------------------------------------------------------------------
+
+# boto3 clients are thread-safe once built, but Session objects are not, so
+# client construction is serialized and every caller reuses the same
+# connection pool (no per-call endpoint resolution or TLS handshakes).
+_client_lock = threading.Lock()
+_session: boto3.session.Session | None = None
+_clients: Dict[str, Any] = {}
 
-        time.sleep(1)
+
+def _client_config(service: str) -> Config:
+    """botocore config shared by every AWS client of this server."""
+    extra: Dict[str, Any] = {}
+    if service == "s3" and _endpoint_url(service):
+        # Local S3 stand-ins generally only support path-style URLs.
+        extra["s3"] = {"addressing_style": "path"}
+    return Config(
+        region_name=AWS_REGION,
+        max_pool_connections=ATHENA_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=ATHENA_CONNECT_TIMEOUT_SEC,
+        read_timeout=ATHENA_READ_TIMEOUT_SEC,
+        retries={
+            "mode": ATHENA_RETRY_MODE,
+            "max_attempts": ATHENA_MAX_RETRY_ATTEMPTS,
+        },
+        **extra,
+    )
 
 
-def _get_rows_raw(query_id: str):
+def _endpoint_url(service: str) -> str | None:
     """
-    Return rows (excluding header) and column names.
+    Endpoint override for a service (local stubs, VPC endpoints).
 
-    Returns:
-        (data_rows, columns)
-            data_rows: List[List[str | None]]
-            columns:   List[str]
+    Athena uses MTB_ATHENA_ENDPOINT_URL, other services
+    MTB_ATHENA_<SERVICE>_ENDPOINT_URL.
     """
-    resp = get_athena_client().get_query_results(QueryExecutionId=query_id)
-    rows = resp["ResultSet"]["Rows"]
+    if service == "athena":
+        return ATHENA_ENDPOINT_URL
+    return os.getenv(f"MTB_ATHENA_{service.upper()}_ENDPOINT_URL") or None
 
-    if not rows:
-        return [], []
 
-    header_row = rows[0]
-    data_rows = rows[1:]
+def get_aws_client(service: str):
+    """Return the process-wide client for an AWS service, creating it once."""
+    client = _clients.get(service)
+    if client is not None:
+        return client
 
-    columns = [c.get("VarCharValue") for c in header_row["Data"]]
-    data = [[c.get("VarCharValue") for c in r["Data"]] for r in data_rows]
-    return data, columns
+    global _session
+    with _client_lock:
+        client = _clients.get(service)
+        if client is None:
+            if _session is None:
+                _session = boto3.session.Session(region_name=AWS_REGION)
+            client = _session.client(
+                service,
+                config=_client_config(service),
+                endpoint_url=_endpoint_url(service),
+            )
+            _clients[service] = client
+    return client
 
 
-def is_safe_readonly_query(sql: str) -> tuple[bool, str | None]:
+def reset_aws_clients() -> None:
+    """Drop cached clients/session (e.g. after rotating credentials)."""
+    global _session
+    with _client_lock:
+        _clients.clear()
+        _session = None
+
+
+def get_athena_client():
+    """Get the shared Athena client with proper region configuration."""
+    return get_aws_client("athena")
+
+
+def get_glue_client():
+    """Get the shared Glue (Data Catalog) client."""
+    return get_aws_client("glue")
+
+
+def get_s3_client():
+    """Get the shared S3 client (query result files)."""
+    return get_aws_client("s3")
+
+
+# --------------------------------------------------------------------
+# Blocking I/O off the event loop
+# --------------------------------------------------------------------
+
+# boto3 is synchronous; every AWS call runs on this bounded pool so one slow
+# query never stalls the FastMCP event loop or other concurrent tool calls.
+_io_executor = ThreadPoolExecutor(
+    max_workers=MAX_IO_WORKERS,
+    thread_name_prefix="mtb_athena_io",
+)
+
+# Separate pool for result-page prefetch: prefetches are submitted from
+# threads of _io_executor and must never wait on a slot in that same pool.
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=4,
+    thread_name_prefix="mtb_athena_prefetch",
+)
+
+
+# Separate pool for Glue schema sweeps (see SCHEMA_FETCH_CONCURRENCY).
+_schema_executor = ThreadPoolExecutor(
+    max_workers=max(1, SCHEMA_FETCH_CONCURRENCY),
+    thread_name_prefix="mtb_athena_schema",
+)
+
+
+async def _run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking callable on the I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _io_executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+_THROTTLING_ERRORS = ("TooManyRequestsException", "ThrottlingException")
+
+
+def _is_throttled(exc: ClientError) -> bool:
+    return exc.response.get("Error", {}).get("Code") in _THROTTLING_ERRORS
+
+
+def _throttle_delays() -> Iterator[float]:
+    """Decorrelated jitter: each delay is uniform in [base, 3 x previous], capped."""
+    delay = THROTTLE_BASE_SEC
+    for _ in range(THROTTLE_MAX_RETRIES):
+        delay = min(THROTTLE_MAX_SEC, random.uniform(THROTTLE_BASE_SEC, delay * 3))
+        yield delay
+
+
+async def _athena_call(operation: str, **kwargs) -> Dict[str, Any]:
     """
-    Check if SQL is safe read-only query.
-    Returns (is_safe, error_message)
+    Await a single Athena API call, e.g. _athena_call("get_query_execution", ...).
+
+    Throttling errors that outlast botocore's own retries (e.g. the
+    workgroup's active-query limit on StartQueryExecution) are retried with
+    decorrelated jitter before giving up.
     """
-    sql_stripped = sql.strip().lower()
-    
-    # Must start with safe commands
-    safe_starts = ['select', 'show', 'describe', 'explain']
-    if not any(sql_stripped.startswith(start) for start in safe_starts):
-        return False, "Query must start with SELECT, SHOW, DESCRIBE, or EXPLAIN"
-    
-    # Check for forbidden keywords at word boundaries
-    forbidden_pattern = r'\b(?:insert|update|delete|create|drop|alter|truncate|grant|revoke)\b'
-    if re.search(forbidden_pattern, sql_stripped):
-        return False, "Query contains forbidden SQL keywords"
-        
-    return True, None
+    delays = _throttle_delays()
+    while True:
+        started = time.monotonic()
+        try:
+            return await _run_blocking(getattr(get_athena_client(), operation), **kwargs)
+        except ClientError as exc:
+            if not _is_throttled(exc):
+                raise
+            _metrics.inc("athena_throttled_total", operation=operation)
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            _log.debug("%s throttled, retrying in %.2fs", operation, delay)
+            await asyncio.sleep(delay)
+        finally:
+            _metrics.observe(
+                "athena_api_call_ms", (time.monotonic() - started) * 1000, operation=operation
+            )
 
 
 # --------------------------------------------------------------------
-# MCP Tools
+# SQL analysis
 # --------------------------------------------------------------------
 
-@mcp.tool()
-async def list_tables(database: str | None = None) -> List[str]:
-    """
-    List Athena tables for a given database.
+# Memoized parses (repeated SQL from the agent, cache keys, history lookups)
+SQL_ANALYSIS_CACHE_SIZE = int(os.getenv("MTB_ATHENA_SQL_ANALYSIS_CACHE_SIZE", "512"))
 
-    Args:
-        database: Athena database name. If omitted, uses MTB_ATHENA_DEFAULT_DB.
+_READONLY_STATEMENTS = ("select", "with", "values", "show", "describe", "explain")
+_QUERY_STATEMENTS = ("select", "with", "values")
+# Results of these can change between identical runs.
+_VOLATILE_FUNCTIONS = frozenset(
+    ["now", "rand", "random", "uuid", "current_date", "current_time",
+     "current_timestamp", "current_timezone", "localtime", "localtimestamp"]
+)
+_CLAUSE_KEYWORDS = frozenset(
+    ["select", "from", "where", "group", "having", "window", "order", "limit",
+     "offset", "fetch"]
+)
+_SET_OPERATIONS = frozenset(["union", "intersect", "except"])
+# Words that end a FROM item instead of naming its alias
+_NOT_ALIAS = _CLAUSE_KEYWORDS | _SET_OPERATIONS | frozenset(
+    ["join", "inner", "left", "right", "full", "outer", "cross", "natural",
+     "on", "using", "tablesample", "as", "lateral", "unnest"]
+)
+
+
+class _SqlToken(NamedTuple):
+    kind: str  # word | number | string | ident | op
+    text: str
+    start: int
+    end: int
+
+    @property
+    def keyword(self) -> str:
+        """Lower-cased text of an unquoted word, "" for anything else."""
+        return self.text.lower() if self.kind == "word" else ""
+
+    @property
+    def name(self) -> str:
+        """Identifier value: unquoted and lower-cased."""
+        if self.kind == "ident":
+            return self.text[1:-1].replace('""', '"').lower()
+        return self.text.lower()
+
+
+class _TableRef(NamedTuple):
+    """A table read in a FROM / JOIN clause."""
+
+    database: str | None
+    table: str
+    alias: str | None
+    block: int  # index into _SqlAnalysis.blocks
+    start: int  # character span of the reference, alias included
+    end: int
+    sample: tuple[str, float] | None = None  # TABLESAMPLE (method, percent)
+
+
+class _SqlBlock(NamedTuple):
+    """One SELECT (or set-operation branch): its clauses at this nesting level."""
+
+    parent: int | None
+    # clause keyword ("select", "from", "where", "group", ...) -> token span
+    clauses: Dict[str, tuple[int, int]]
+
+
+class _SqlAnalysis(NamedTuple):
+    statement: str  # first keyword (select, with, show, ...), "" if none
+    error: str | None  # why this isn't a safe read-only query
+    tokens: tuple[_SqlToken, ...]
+    blocks: tuple[_SqlBlock, ...]
+    tables: tuple[_TableRef, ...]  # CTE references excluded
+    identifiers: frozenset[str]
+    select_star: bool
+    volatile: bool
+    limit_at: int | None  # token index of the outermost LIMIT
+    fetch_first: bool  # outermost row limit is FETCH FIRST
+    normalized: str
+    fingerprint: str
+
+
+_SQL_TOKEN = re.compile(
+    r"""
+    (?P<skip>\s+|--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|`[^`]*`)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>\w+)
+  | (?P<op><>|!=|<=|>=|\|\||=>|->|.)
+    """,
+    re.S | re.X,
+)
+
+
+def _sql_tokens(sql: str) -> List[_SqlToken]:
+    """Lex SQL into tokens, dropping whitespace and comments."""
+    return [
+        _SqlToken(m.lastgroup, m.group(), m.start(), m.end())
+        for m in _SQL_TOKEN.finditer(sql)
+        if m.lastgroup != "skip"
+    ]
+
+
+class _SqlParser:
     """
-    db = database or DEFAULT_DATABASE
-    if not db:
-        raise ValueError(
-            "No database provided and MTB_ATHENA_DEFAULT_DB is not set."
+    Recursive-descent pass over the token stream: query blocks and their
+    clauses, FROM / JOIN table references (with aliases), CTE names and
+    SELECT *. It only understands as much SQL as the server needs and
+    never rejects a statement Athena would accept.
+    """
+
+    def __init__(self, tokens: List[_SqlToken]):
+        self.tokens = tokens
+        self.blocks: List[_SqlBlock] = []
+        self.tables: List[_TableRef] = []
+        self.ctes: set[str] = set()
+        self.select_star = False
+        self.partner: Dict[int, int] = {}
+        stack = []
+        for i, tok in enumerate(tokens):
+            if tok.text == "(":
+                stack.append(i)
+            elif tok.text == ")":
+                if not stack:
+                    raise ValueError("Unbalanced parentheses")
+                self.partner[stack.pop()] = i
+        if stack:
+            raise ValueError("Unbalanced parentheses")
+
+    def parse(self, lo: int, hi: int, parent: int | None = None) -> None:
+        tokens = self.tokens
+        block = self._new_block(parent)
+        clause, clause_lo = None, lo
+        expect_table = False
+        i = lo
+        while i < hi:
+            tok = tokens[i]
+            kw = tok.keyword
+            if tok.text == "(":
+                close = self.partner[i]
+                self.parse(i + 1, close, block)
+                i = close + 1
+                if expect_table:  # derived table: skip its alias
+                    expect_table = False
+                    i = self._alias(i, hi)[1]
+                continue
+            if kw == "with" and clause is None:
+                i = self._with(i + 1, hi, block)
+                continue
+            if kw in _SET_OPERATIONS:
+                self._close(block, clause, clause_lo, i)
+                block = self._new_block(parent)
+                clause, clause_lo = None, i + 1
+                expect_table = False
+            elif kw in _CLAUSE_KEYWORDS and (kw == "select" or clause is not None):
+                # Before a block's SELECT, FROM / ORDER BY belong to a
+                # function call (extract(... FROM ...), OVER (ORDER BY ...)).
+                self._close(block, clause, clause_lo, i)
+                clause = kw
+                i += 2 if kw in ("group", "order") and i + 1 < hi and tokens[i + 1].keyword == "by" else 1
+                clause_lo = i
+                expect_table = kw == "from"
+                continue
+            elif clause == "from" and (kw == "join" or tok.text == ","):
+                expect_table = True
+            elif expect_table and tok.kind in ("word", "ident") and kw not in _NOT_ALIAS:
+                i = self._table(i, hi, block)
+                expect_table = False
+                continue
+            elif clause == "select" and tok.text == "*":
+                prev = tokens[i - 1] if i > lo else None
+                if prev is None or prev.text in (",", ".") or prev.keyword in ("select", "distinct", "all"):
+                    self.select_star = True
+            else:
+                expect_table = False
+            i += 1
+        self._close(block, clause, clause_lo, hi)
+
+    def _new_block(self, parent: int | None) -> int:
+        self.blocks.append(_SqlBlock(parent, {}))
+        return len(self.blocks) - 1
+
+    def _close(self, block: int, clause: str | None, lo: int, hi: int) -> None:
+        if clause is not None:
+            self.blocks[block].clauses.setdefault(clause, (lo, hi))
+
+    def _with(self, i: int, hi: int, block: int) -> int:
+        """Parse `[RECURSIVE] name [(cols)] AS (query), ...`; returns the index after it."""
+        tokens = self.tokens
+        if i < hi and tokens[i].keyword == "recursive":
+            i += 1
+        while i < hi and tokens[i].kind in ("word", "ident"):
+            self.ctes.add(tokens[i].name)
+            i += 1
+            if i < hi and tokens[i].text == "(":
+                i = self.partner[i] + 1
+            if i < hi and tokens[i].keyword == "as":
+                i += 1
+            if i < hi and tokens[i].text == "(":
+                close = self.partner[i]
+                self.parse(i + 1, close, block)
+                i = close + 1
+            if i < hi and tokens[i].text == ",":
+                i += 1
+            else:
+                break
+        return i
+
+    def _table(self, i: int, hi: int, block: int) -> int:
+        """Record the (possibly qualified) table name at `i`; returns the index after its alias."""
+        tokens = self.tokens
+        parts = [tokens[i]]
+        j = i + 1
+        while (
+            j + 1 < hi
+            and tokens[j].text == "."
+            and tokens[j + 1].kind in ("word", "ident")
+        ):
+            parts.append(tokens[j + 1])
+            j += 2
+        alias, end = self._alias(j, hi)
+        names = [p.name for p in parts]
+        sample = None
+        if (
+            end + 4 < hi
+            and tokens[end].keyword == "tablesample"
+            and tokens[end + 2].text == "("
+            and tokens[end + 3].kind == "number"
+        ):
+            sample = (tokens[end + 1].keyword, float(tokens[end + 3].text))
+        self.tables.append(
+            _TableRef(
+                database=names[-2] if len(names) > 1 else None,
+                table=names[-1],
+                alias=alias,
+                block=block,
+                start=tokens[i].start,
+                end=tokens[end - 1].end,
+                sample=sample,
+            )
         )
+        return end
 
-    query = f"SHOW TABLES IN {db}"
-    print(f"[mtb_athena] list_tables: {query}")
+    def _alias(self, i: int, hi: int) -> tuple[str | None, int]:
+        """(alias, index after it) for a FROM item ending before `i`."""
+        tokens = self.tokens
+        j = i + 1 if i < hi and tokens[i].keyword == "as" else i
+        if j < hi and tokens[j].kind in ("word", "ident") and tokens[j].keyword not in _NOT_ALIAS:
+            return tokens[j].name, j + 1
+        return None, i
 
-    resp = get_athena_client().start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": db},
-        WorkGroup=ATHENA_WORKGROUP,
-        ResultConfiguration={"OutputLocation": ATHENA_OUTPUT_LOCATION},
-    )
-    qid = resp["QueryExecutionId"]
-    _wait_for_query(qid)
 
-    rows, _ = _get_rows_raw(qid)
-    tables = [r[0] for r in rows if r and r[0]]
-    return tables
+def _explain_target(tokens: List[_SqlToken]) -> str:
+    """Leading keyword of the statement an EXPLAIN [ANALYZE] [(options)] wraps."""
+    i = 1
+    while i < len(tokens) and tokens[i].keyword in ("analyze", "verbose"):
+        i += 1
+    if i < len(tokens) and tokens[i].text == "(":
+        depth = 0
+        for i in range(i, len(tokens)):
+            depth += (tokens[i].text == "(") - (tokens[i].text == ")")
+            if depth == 0:
+                break
+        i += 1
+    return next((t.keyword for t in tokens[i:] if t.text != "("), "")
 
 
-@mcp.tool()
-async def describe_table(database: str, table: str) -> List[Dict[str, Any]]:
+def _statement_error(tokens: List[_SqlToken], statement: str) -> str | None:
     """
-    Describe columns for a table: name, type, comment.
+    Why `tokens` is not a single read-only statement, or None. Only the
+    statement head decides (and, for EXPLAIN, the head of the statement it
+    wraps): Trino has no DML nested in queries, so words like truncate(x)
+    or a column named merge elsewhere in the query are harmless.
+    """
+    if not tokens:
+        return "Empty query"
+    if statement not in _READONLY_STATEMENTS:
+        return "Query must start with SELECT, WITH, SHOW, DESCRIBE, or EXPLAIN"
+    depth = 0
+    for i, tok in enumerate(tokens):
+        depth += (tok.text == "(") - (tok.text == ")")
+        if depth == 0 and tok.text == ";" and any(t.text != ";" for t in tokens[i:]):
+            return "Only one statement per query"
+    # EXPLAIN ANALYZE runs its statement: that one must be a query too.
+    if statement == "explain" and _explain_target(tokens) not in _QUERY_STATEMENTS:
+        return "EXPLAIN is only allowed for SELECT queries"
+    return None
 
-    Args:
-        database: Athena database name
-        table:    table name
+
+@functools.lru_cache(maxsize=SQL_ANALYSIS_CACHE_SIZE)
+def _analyze_sql(sql: str) -> _SqlAnalysis:
     """
-    query = f"DESCRIBE {table}"
-    print(f"[mtb_athena] describe_table: {query} (db={database})")
+    Parse `sql` once into everything the server asks of a statement: the
+    read-only check, tables read, columns mentioned, the outermost LIMIT,
+    cache-key normalization and the history fingerprint. Memoized.
+    """
+    tokens = _sql_tokens(sql)
+    while tokens and tokens[-1].text == ";":
+        tokens.pop()
+    statement = next((t.keyword for t in tokens if t.text != "("), "")
+    error = _statement_error(tokens, statement)
 
-    resp = get_athena_client().start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": database},
-        WorkGroup=ATHENA_WORKGROUP,
-        ResultConfiguration={"OutputLocation": ATHENA_OUTPUT_LOCATION},
+    parser = None
+    if error is None:
+        try:
+            parser = _SqlParser(tokens)
+            parser.parse(0, len(tokens))
+        except ValueError as exc:
+            error, parser = str(exc), None
+
+    depth, limit_at, fetch_first = 0, None, False
+    for i, tok in enumerate(tokens):
+        depth += (tok.text == "(") - (tok.text == ")")
+        if depth == 0 and tok.keyword == "limit":
+            limit_at = i
+        elif depth == 0 and tok.keyword == "fetch":
+            fetch_first = True
+
+    # Normalized text keeps literal values; the fingerprint drops them so
+    # `... LIMIT 5` and `... LIMIT 50` share latency history (but not
+    # TABLESAMPLE percentages, which change the bytes scanned).
+    normalized = " ".join(t.text if t.kind == "string" else t.text.lower() for t in tokens)
+    shape = " ".join(
+        "?" if t.kind in ("string", "number") and not (i > 2 and tokens[i - 3].keyword == "tablesample")
+        else t.text.lower()
+        for i, t in enumerate(tokens)
     )
-    qid = resp["QueryExecutionId"]
-    _wait_for_query(qid)
+    shape = re.sub(r"\( \?(?: , \?)* \)", "(?)", shape)
 
-    rows, _ = _get_rows_raw(qid)
+    tables = ()
+    if parser is not None:
+        tables = tuple(
+            t for t in parser.tables if t.database is not None or t.table not in parser.ctes
+        )
+    return _SqlAnalysis(
+        statement=statement,
+        error=error,
+        tokens=tuple(tokens),
+        blocks=tuple(parser.blocks) if parser else (),
+        tables=tables,
+        identifiers=frozenset(t.name for t in tokens if t.kind in ("word", "ident")),
+        select_star=bool(parser and parser.select_star),
+        volatile=any(t.keyword in _VOLATILE_FUNCTIONS for t in tokens),
+        limit_at=limit_at,
+        fetch_first=fetch_first,
+        normalized=normalized,
+        fingerprint=hashlib.sha1(shape.encode()).hexdigest()[:16],
+    )
 
-    result: List[Dict[str, Any]] = []
-    for r in rows:
-        if not r or not r[0] or r[0].startswith("#"):
-            continue
-        name = r[0]
-        dtype = r[1] if len(r) > 1 else ""
-        comment = r[2] if len(r) > 2 else ""
-        result.append({"name": name, "type": dtype, "comment": comment})
 
-    return result
+def _normalize_sql(sql: str) -> str:
+    """
+    Canonical text of a query: comments dropped, whitespace collapsed,
+    trailing semicolons removed and everything outside string literals
+    lower-cased. Literal values are kept (unlike _query_fingerprint).
+    """
+    return _analyze_sql(sql).normalized
 
 
-@mcp.tool()
-async def run_readonly_query(
-    database: str,
-    sql: str,
-    max_rows: int = 50,
-) -> List[Dict[str, Any]]:
+def _query_fingerprint(sql: str) -> str:
     """
-    Run a SELECT-only Athena query and return rows as list-of-dicts.
+    Fingerprint of a query's shape: literals, numbers and whitespace are
+    normalized away so `... LIMIT 5` and `... LIMIT 50` share history.
+    """
+    return _analyze_sql(sql).fingerprint
 
-    Args:
-        database: Athena database name
-        sql:      SQL query (must be read-only)
-        max_rows: max number of rows to return (default 50)
+
+def _statement_text(sql: str) -> str:
     """
-    is_safe, error = is_safe_readonly_query(sql)
-    if not is_safe:
-        raise ValueError(error)
+    `sql` without leading/trailing comments and semicolons, safe to wrap
+    in another statement (a trailing `-- comment` would swallow what follows).
+    """
+    tokens = _analyze_sql(sql).tokens
+    return sql[tokens[0].start:tokens[-1].end] if tokens else sql.strip()
 
-    print(
-        f"[mtb_athena] run_readonly_query on {database} "
-        f"(max_rows={max_rows}):\n{sql}\n"
-    )
 
-    resp = get_athena_client().start_query_execution(
+def _push_down_limit(sql: str, limit: int) -> str | None:
+    """
+    `sql` with its outermost LIMIT lowered to `limit` (or appended, after
+    any ORDER BY / OFFSET, when there is none). None if the statement is
+    not a query, is already limited at least as tightly, or ends in a form
+    this doesn't rewrite (FETCH FIRST, LIMIT not last).
+    """
+    analysis = _analyze_sql(sql)
+    tokens = analysis.tokens
+    if analysis.error or analysis.statement not in _QUERY_STATEMENTS or analysis.fetch_first:
+        return None
+
+    end = tokens[-1].end
+    if analysis.limit_at is None:
+        return f"{sql[:end]}\nLIMIT {limit}"
+    if analysis.limit_at != len(tokens) - 2:
+        return None
+    count = tokens[-1]
+    if count.kind == "number" and count.text.isdigit() and int(count.text) <= limit:
+        return None
+    if count.kind != "number" and count.keyword != "all":
+        return None
+    return f"{sql[:count.start]}{limit}"
+
+
+# --------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------
+
+
+class _LatencyHistory:
+    """
+    Thread-safe, bounded EWMA of engine runtime and bytes scanned per query
+    fingerprint. Seeds the poll schedule of queries we've seen before and
+    estimates what a cancelled query would have scanned.
+    """
+
+    def __init__(self, max_entries: int = 1024, alpha: float = 0.3):
+        self._max_entries = max_entries
+        self._alpha = alpha
+        self._lock = threading.Lock()
+        # fingerprint -> (runtime_sec, scanned_bytes)
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def _get(self, fingerprint: str) -> tuple[float, float] | None:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+            return entry
+
+    def predict(self, fingerprint: str) -> float | None:
+        entry = self._get(fingerprint)
+        return entry[0] if entry else None
+
+    def predict_bytes(self, fingerprint: str) -> float | None:
+        entry = self._get(fingerprint)
+        return entry[1] if entry else None
+
+    def record(self, fingerprint: str, runtime_sec: float, scanned_bytes: float = 0) -> None:
+        with self._lock:
+            previous = self._entries.pop(fingerprint, None)
+            if previous is not None:
+                a = self._alpha
+                runtime_sec = a * runtime_sec + (1 - a) * previous[0]
+                scanned_bytes = a * scanned_bytes + (1 - a) * previous[1]
+            self._entries[fingerprint] = (runtime_sec, scanned_bytes)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+_latency_history = _LatencyHistory()
+
+
+def _poll_delays(predicted_sec: float | None = None) -> Iterator[float]:
+    """
+    Yield sleep intervals between status polls.
+
+    Starts at POLL_INITIAL_SEC and backs off by POLL_BACKOFF up to
+    POLL_MAX_SEC, with +/-25% jitter. With a runtime prediction, the first
+    sleep jumps to ~80% of it and fine-grained polling restarts from there.
+    """
+    if predicted_sec and predicted_sec * 0.8 > POLL_INITIAL_SEC:
+        yield min(predicted_sec * 0.8, POLL_MAX_SEC * 4)
+
+    delay = POLL_INITIAL_SEC
+    while True:
+        yield delay * random.uniform(0.75, 1.25)
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_SEC)
+
+
+# In-flight QueryExecutionIds, so abandoned queries can be stopped instead of
+# running (and billing for data scanned) in the workgroup.
+_inflight_lock = threading.Lock()
+_inflight_queries: Dict[str, Dict[str, Any]] = {}
+
+
+def _untrack_query(query_id: str) -> Dict[str, Any] | None:
+    with _inflight_lock:
+        return _inflight_queries.pop(query_id, None)
+
+
+def _stop_query(query_id: str, reason: str) -> None:
+    """
+    Blocking: issue StopQueryExecution for an in-flight query and record
+    cancellation metrics (bytes scanned so far, estimated bytes saved).
+    """
+    info = _untrack_query(query_id)
+    if info is None:
+        return  # already finished or stopped
+
+    client = get_athena_client()
+    try:
+        client.stop_query_execution(QueryExecutionId=query_id)
+        stats = client.get_query_execution(QueryExecutionId=query_id)[
+            "QueryExecution"
+        ].get("Statistics", {})
+    except Exception as exc:
+        _log.warning("failed to stop query %s: %s", query_id, exc)
+        return
+
+    scanned = stats.get("DataScannedInBytes", 0)
+    _scan_budget.charge(scanned)
+    typical = _latency_history.predict_bytes(info["fingerprint"])
+    _metrics.inc("athena_queries_cancelled_total", reason=reason)
+    _metrics.inc("athena_cancelled_bytes_scanned_total", scanned)
+    if typical:
+        _metrics.inc("athena_cancelled_bytes_saved_estimate_total", max(typical - scanned, 0))
+    _log.info("stopped query %s (%s), scanned=%dB", query_id, reason, scanned)
+
+
+def _stop_inflight_queries(reason: str = "shutdown") -> None:
+    """Stop every query still in flight (server shutdown)."""
+    with _inflight_lock:
+        query_ids = list(_inflight_queries)
+    for query_id in query_ids:
+        _stop_query(query_id, reason)
+
+
+def _reuse_max_age(tool: str, override: int | None = None) -> int:
+    """Result reuse max age for a tool call: per-call override, else config."""
+    minutes = RESULT_REUSE_MAX_AGE_MIN.get(tool, 0) if override is None else override
+    return max(0, min(int(minutes), RESULT_REUSE_MAX_AGE_LIMIT_MIN))
+
+
+# Scheduler priorities (lower runs first)
+PRIORITY_METADATA = 0  # SHOW / DESCRIBE / EXPLAIN: cheap, gate the agent's next step
+PRIORITY_QUERY = 1
+PRIORITY_BULK = 2  # exports and queries estimated to scan HEAVY_SCAN_BYTES or more
+
+
+
+def _query_priority(sql: str) -> int:
+    if _analyze_sql(sql).statement in ("show", "describe", "explain"):
+        return PRIORITY_METADATA
+    return PRIORITY_QUERY
+
+
+class _QueryScheduler:
+    """
+    Caps the queries running at once per workgroup. A query holds a slot
+    from StartQueryExecution until it finishes; callers beyond the cap wait
+    in a priority queue (priority, then arrival order), so metadata lookups
+    overtake queued heavy scans. Event-loop only.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self._active: Dict[str, int] = defaultdict(int)
+        # workgroup -> heap of (priority, seq, future)
+        self._waiting: Dict[str, List[tuple[int, int, asyncio.Future]]] = defaultdict(list)
+        self._seq = itertools.count()
+
+    def _publish(self, workgroup: str) -> None:
+        _metrics.set("scheduler_active_queries", self._active[workgroup], workgroup=workgroup)
+        _metrics.set(
+            "scheduler_queue_depth",
+            sum(1 for *_, f in self._waiting[workgroup] if not f.done()),
+            workgroup=workgroup,
+        )
+
+    @contextlib.asynccontextmanager
+    async def slot(self, workgroup: str, priority: int):
+        """Hold one of the workgroup's query slots; yields the ms spent waiting."""
+        started = time.monotonic()
+        if self.max_concurrent > 0:
+            await self._acquire(workgroup, priority)
+        waited_ms = int((time.monotonic() - started) * 1000)
+        _metrics.observe("scheduler_wait_ms", waited_ms, priority=priority)
+        try:
+            yield waited_ms
+        finally:
+            if self.max_concurrent > 0:
+                self._release(workgroup)
+
+    async def _acquire(self, workgroup: str, priority: int) -> None:
+        if self._active[workgroup] < self.max_concurrent and not self._waiting[workgroup]:
+            self._active[workgroup] += 1
+            self._publish(workgroup)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting[workgroup], (priority, next(self._seq), future))
+        self._publish(workgroup)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(workgroup)  # granted just as we were cancelled
+            else:
+                self._publish(workgroup)
+            raise
+
+    def _release(self, workgroup: str) -> None:
+        self._active[workgroup] -= 1
+        waiting = self._waiting[workgroup]
+        while waiting and self._active[workgroup] < self.max_concurrent:
+            _, _, future = heapq.heappop(waiting)
+            if not future.done():
+                self._active[workgroup] += 1
+                future.set_result(None)
+        self._publish(workgroup)
+
+
+_scheduler = _QueryScheduler(MAX_CONCURRENT_QUERIES)
+
+
+async def _start_query(database: str, sql: str, reuse_max_age_min: int = 0) -> str:
+    """
+    Submit a query to the configured workgroup and return its id.
+
+    With `reuse_max_age_min` > 0, Athena may answer from a previous
+    identical query's results up to that age instead of re-scanning.
+    """
+    kwargs: Dict[str, Any] = {}
+    if reuse_max_age_min > 0:
+        kwargs["ResultReuseConfiguration"] = {
+            "ResultReuseByAgeConfiguration": {
+                "Enabled": True,
+                "MaxAgeInMinutes": reuse_max_age_min,
+            }
+        }
+    resp = await _athena_call(
+        "start_query_execution",
         QueryString=sql,
         QueryExecutionContext={"Database": database},
         WorkGroup=ATHENA_WORKGROUP,
         ResultConfiguration={"OutputLocation": ATHENA_OUTPUT_LOCATION},
+        **kwargs,
     )
-    qid = resp["QueryExecutionId"]
+    query_id = resp["QueryExecutionId"]
+    with _inflight_lock:
+        _inflight_queries[query_id] = {
+            "fingerprint": _query_fingerprint(sql),
+            "started": time.time(),
+        }
+    _metrics.inc("athena_queries_started_total")
+    return query_id
 
-    _wait_for_query(qid)
 
-    rows, columns = _get_rows_raw(qid)
-    rows = rows[:max_rows]
+async def _wait_for_query(
+    query_id: str,
+    timeout_sec: int | None = None,
+    poller: "_BatchPoller | None" = None,
+) -> Dict[str, Any]:
+    """
+    Poll Athena until query is SUCCEEDED or FAILED/CANCELLED (on its own,
+    or together with other queries through `poller`).
+
+    Returns:
+        Wait stats: polls, wall-clock wait, Athena queue/engine time and the
+        lag our polling added on top of the engine time (all in ms), bytes
+        scanned and whether Athena reused a previous result.
+
+    The query is stopped (StopQueryExecution) if the wait times out or the
+    awaiting tool call is cancelled, e.g. because the MCP client went away.
+
+    Raises:
+        RuntimeError on FAILED/CANCELLED
+        TimeoutError on timeout
+    """
+    try:
+        if poller is not None:
+            wait_stats = await poller.wait(query_id)
+        else:
+            wait_stats = await _poll_query(query_id, timeout_sec)
+    except TimeoutError:
+        await _run_blocking(_stop_query, query_id, "timeout")
+        raise
+    except asyncio.CancelledError:
+        # Don't await while being cancelled; stop in the background.
+        _io_executor.submit(_stop_query, query_id, "cancelled")
+        raise
+    except Exception:
+        _untrack_query(query_id)
+        raise
+
+    _untrack_query(query_id)
+    return wait_stats
+
+
+def _record_query_stats(wait_stats: Dict[str, Any], state: str) -> None:
+    """Per-tool summaries of a finished query's Athena statistics."""
+    tool = _current_tool.get()
+    _metrics.inc("athena_queries_total", tool=tool, state=state)
+    for stat in ("queued_ms", "planning_ms", "engine_ms", "service_ms", "wait_ms"):
+        _metrics.observe(f"athena_query_{stat}", wait_stats[stat], tool=tool)
+    _metrics.observe("athena_query_scanned_bytes", wait_stats["data_scanned_bytes"], tool=tool)
+
+
+def _finished_query_stats(
+    query_id: str, execution: Dict[str, Any], polls: int, wait_ms: int
+) -> Dict[str, Any] | None:
+    """
+    Wait stats of a SUCCEEDED QueryExecution (recording history, reuse
+    savings, budget and metrics), None while it is still queued/running.
+
+    Raises:
+        RuntimeError on FAILED/CANCELLED
+    """
+    status = execution["Status"]
+    state = status["State"]
+    fingerprint = _query_fingerprint(execution.get("Query", ""))
+
+    if state == "SUCCEEDED":
+        stats = execution.get("Statistics", {})
+        engine_ms = stats.get("TotalExecutionTimeInMillis", wait_ms)
+        scanned = stats.get("DataScannedInBytes", 0)
+        _scan_budget.charge(scanned)
+        reused = stats.get("ResultReuseInformation", {}).get(
+            "ReusedPreviousResult", False
+        )
+        if reused:
+            # Don't let near-free reused runs skew the history; use it
+            # instead to estimate what the reuse saved.
+            typical_sec = _latency_history.predict(fingerprint)
+            typical_bytes = _latency_history.predict_bytes(fingerprint)
+            _metrics.inc("athena_result_reuse_total")
+            if typical_bytes:
+                _metrics.inc(
+                    "athena_result_reuse_bytes_saved_estimate_total",
+                    max(typical_bytes - scanned, 0),
+                )
+            if typical_sec:
+                _metrics.inc(
+                    "athena_result_reuse_ms_saved_estimate_total",
+                    max(typical_sec * 1000 - engine_ms, 0),
+                )
+        else:
+            _latency_history.record(fingerprint, engine_ms / 1000, scanned)
+        wait_stats = {
+            "polls": polls,
+            "wait_ms": wait_ms,
+            "queued_ms": stats.get("QueryQueueTimeInMillis", 0),
+            "planning_ms": stats.get("QueryPlanningTimeInMillis", 0),
+            "engine_ms": engine_ms,
+            "service_ms": stats.get("ServiceProcessingTimeInMillis", 0),
+            "poll_lag_ms": max(wait_ms - engine_ms, 0),
+            "data_scanned_bytes": scanned,
+            "reused_result": reused,
+            "statement_type": execution.get("StatementType", ""),
+            "output_location": execution.get("ResultConfiguration", {}).get(
+                "OutputLocation", ""
+            ),
+        }
+        _record_query_stats(wait_stats, "succeeded")
+        return wait_stats
+
+    if state in ("FAILED", "CANCELLED"):
+        # Failed queries are billed for what they scanned too.
+        _scan_budget.charge(execution.get("Statistics", {}).get("DataScannedInBytes", 0))
+        _metrics.inc("athena_queries_total", tool=_current_tool.get(), state=state.lower())
+        reason = status.get("StateChangeReason", "Unknown")
+        raise RuntimeError(
+            f"Athena query {state}. "
+            f"QueryExecutionId={query_id}. Reason={reason}"
+        )
+    return None
+
+
+def _query_timeout_error(query_id: str, timeout: float) -> TimeoutError:
+    return TimeoutError(
+        f"Athena query timed out after {timeout}s "
+        f"(QueryExecutionId={query_id})"
+    )
+
+
+async def _poll_query(query_id: str, timeout_sec: int | None) -> Dict[str, Any]:
+    """Polling loop behind _wait_for_query."""
+    timeout = timeout_sec or DEFAULT_QUERY_TIMEOUT_SEC
+    start = time.monotonic()
+    delays: Iterator[float] | None = None
+    polls = 0
+
+    while True:
+        resp = await _athena_call("get_query_execution", QueryExecutionId=query_id)
+        polls += 1
+        execution = resp["QueryExecution"]
+
+        if delays is None:
+            fingerprint = _query_fingerprint(execution.get("Query", ""))
+            delays = _poll_delays(_latency_history.predict(fingerprint))
+
+        wait_ms = int((time.monotonic() - start) * 1000)
+        wait_stats = _finished_query_stats(query_id, execution, polls, wait_ms)
+        if wait_stats is not None:
+            return wait_stats
+
+        elapsed = time.monotonic() - start
+        if elapsed > timeout:
+            raise _query_timeout_error(query_id, timeout)
+
+        # Never oversleep the deadline by more than one initial interval.
+        await asyncio.sleep(min(next(delays), timeout - elapsed + POLL_INITIAL_SEC))
+
+
+class _BatchPoller:
+    """
+    Waits for many queries at once: one BatchGetQueryExecution call (up to
+    50 ids) per poll round for every query registered, instead of one
+    GetQueryExecution loop per query. Queries can join while others are
+    being polled; the backoff restarts when one does.
+    """
+
+    BATCH_LIMIT = 50
+
+    def __init__(self, timeout_sec: int | None = None):
+        self.timeout = timeout_sec or DEFAULT_QUERY_TIMEOUT_SEC
+        # query id -> {"future", "started", "polls"}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._joined = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def wait(self, query_id: str) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending[query_id] = {"future": future, "started": time.monotonic(), "polls": 0}
+        self._joined.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        try:
+            return await future
+        finally:
+            self._pending.pop(query_id, None)
+
+    async def _poll(self) -> None:
+        delays = _poll_delays()
+        while self._pending:
+            if self._joined.is_set():
+                self._joined.clear()
+                delays = _poll_delays()
+            query_ids = [q for q, p in self._pending.items() if not p["future"].done()]
+            for i in range(0, len(query_ids), self.BATCH_LIMIT):
+                chunk = query_ids[i:i + self.BATCH_LIMIT]
+                try:
+                    resp = await _athena_call("batch_get_query_execution", QueryExecutionIds=chunk)
+                except Exception as exc:
+                    for query_id in chunk:
+                        self._settle(query_id, error=exc)
+                    continue
+                _metrics.inc("athena_batch_polls_total")
+                for execution in resp.get("QueryExecutions", []):
+                    self._settle(execution["QueryExecutionId"], execution=execution)
+
+            now = time.monotonic()
+            for query_id, pending in list(self._pending.items()):
+                if not pending["future"].done() and now - pending["started"] > self.timeout:
+                    self._settle(query_id, error=_query_timeout_error(query_id, self.timeout))
+            if all(p["future"].done() for p in self._pending.values()):
+                return  # a query joining later starts a new round
+
+            try:
+                await asyncio.wait_for(self._joined.wait(), next(delays))
+            except asyncio.TimeoutError:
+                pass
+
+    def _settle(
+        self,
+        query_id: str,
+        execution: Dict[str, Any] | None = None,
+        error: BaseException | None = None,
+    ) -> None:
+        pending = self._pending.get(query_id)
+        if pending is None or pending["future"].done():
+            return
+        future = pending["future"]
+        if error is None:
+            pending["polls"] += 1
+            wait_ms = int((time.monotonic() - pending["started"]) * 1000)
+            try:
+                wait_stats = _finished_query_stats(query_id, execution, pending["polls"], wait_ms)
+            except RuntimeError as exc:
+                error = exc
+            else:
+                if wait_stats is not None:
+                    future.set_result(wait_stats)
+                return
+        future.set_exception(error)
+
+
+class _SingleFlight:
+    """
+    Coalesce identical concurrent async operations: the first caller for a
+    key (the leader) starts the work as a task, callers arriving while it
+    runs (followers) await that same task. The task is cancelled only when
+    every caller waiting on it has been cancelled.
+
+    Lives on the server's event loop; not thread-safe.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._flights: Dict[tuple, Dict[str, Any]] = {}
+
+    async def run(self, key: tuple, factory: Callable[[], Any]) -> tuple[Any, bool]:
+        """Return (result, coalesced) where coalesced marks a follower."""
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if flight is None:
+            task = asyncio.ensure_future(factory())
+            flight = {"task": task, "waiters": 0}
+            self._flights[key] = flight
+            task.add_done_callback(lambda _: self._forget(key, flight))
+            _metrics.inc("singleflight_leaders_total", kind=self.kind)
+        else:
+            _metrics.inc("singleflight_coalesced_total", kind=self.kind)
+
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"]), coalesced
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                flight["task"].cancel()
+
+    def _forget(self, key: tuple, flight: Dict[str, Any]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+_query_flights = _SingleFlight("query")
+
+
+async def _execute_query(
+    database: str,
+    sql: str,
+    reuse_max_age_min: int = 0,
+    priority: int | None = None,
+    on_start: Callable[[str], None] | None = None,
+    poller: _BatchPoller | None = None,
+) -> tuple[str, Dict[str, Any]]:
+    """
+    Start a query in a scheduler slot and wait for it (through `poller` if
+    given); wait_stats gain scheduler_wait_ms. `on_start` is called with the
+    QueryExecutionId as soon as Athena accepted the query.
+    """
+    if priority is None:
+        priority = _query_priority(sql)
+    async with _scheduler.slot(ATHENA_WORKGROUP, priority) as scheduler_wait_ms:
+        query_id = await _start_query(database, sql, reuse_max_age_min)
+        if on_start is not None:
+            on_start(query_id)
+        wait_stats = await _wait_for_query(query_id, poller=poller)
+    return query_id, dict(wait_stats, scheduler_wait_ms=scheduler_wait_ms)
+
+
+async def _run_query(
+    database: str,
+    sql: str,
+    reuse_max_age_min: int = 0,
+    priority: int | None = None,
+    poller: _BatchPoller | None = None,
+) -> tuple[str, Dict[str, Any], bool]:
+    """
+    Start a query (through the scheduler) and wait for it, coalescing with
+    an identical query (same database + normalized SQL) already in flight.
+
+    Returns:
+        (query_id, wait_stats, coalesced)
+    """
+
+    def execute():
+        return _execute_query(database, sql, reuse_max_age_min, priority, poller=poller)
+
+    key = (database.lower(), _normalize_sql(sql))
+    (query_id, wait_stats), coalesced = await _query_flights.run(key, execute)
+    return query_id, wait_stats, coalesced
+
+
+def _column_names(column_info: List[Dict[str, Any]]) -> List[str]:
+    return [c.get("Label") or c.get("Name") or "" for c in column_info]
+
+
+def _iter_result_pages(
+    query_id: str,
+    max_rows: int | None = None,
+    next_token: str | None = None,
+    prefetch: bool = False,
+    header: bool | None = None,
+) -> Iterator[tuple[List[Dict[str, Any]], List[List[str | None]], str | None]]:
+    """
+    Stream GetQueryResults pages as (column_info, rows, next_token).
+
+    The header row is dropped, MaxResults is sized from the rows still
+    needed, and paging stops as soon as `max_rows` rows have been yielded
+    (the last page is never over-fetched). With `prefetch`, the next page is
+    requested in the background while the caller converts the current one.
+    Pass `next_token` to resume a previous stream (no header row then).
+    `header` says whether the result starts with a header row (DML: yes,
+    SHOW / DESCRIBE: no; None = detect it). A yielded next_token always
+    resumes right after the rows yielded.
+    """
+    client = get_athena_client()
+    header_pending = next_token is None
+    reserved = header_pending and header is not False
+    remaining = max_rows
+
+    def fetch(token: str | None, header: bool, wanted: int | None):
+        page_size = RESULT_PAGE_SIZE if wanted is None else wanted + header
+        kwargs = {
+            "QueryExecutionId": query_id,
+            "MaxResults": max(1, min(page_size, RESULT_PAGE_SIZE)),
+        }
+        if token:
+            kwargs["NextToken"] = token
+        return client.get_query_results(**kwargs)
+
+    resp = fetch(next_token, reserved, remaining)
+    while True:
+        result_set = resp["ResultSet"]
+        column_info = result_set.get("ResultSetMetadata", {}).get("ColumnInfo", [])
+        rows = [
+            [c.get("VarCharValue") for c in r["Data"]]
+            for r in result_set.get("Rows", [])
+        ]
+
+        # DML results start with a header row; SHOW/DESCRIBE results don't.
+        if header_pending and rows and header is not False:
+            if not column_info:
+                column_info = [{"Name": name or ""} for name in rows[0]]
+                rows = rows[1:]
+            elif rows[0] == _column_names(column_info):
+                rows = rows[1:]
+            elif reserved and remaining is not None and len(rows) > remaining and resp.get("NextToken"):
+                # The slot kept for a header holds a data row: re-read the
+                # page at the right size so its token resumes after our rows.
+                reserved = False
+                resp = fetch(next_token, False, remaining)
+                continue
+        header_pending = False
+
+        token = resp.get("NextToken")
+        if remaining is not None:
+            remaining -= len(rows)
+        more = token is not None and (remaining is None or remaining > 0)
+
+        future = None
+        if more and prefetch:
+            future = _prefetch_executor.submit(fetch, token, False, remaining)
+
+        yield column_info, rows, token
+
+        if not more:
+            return
+        resp = future.result() if future else fetch(token, False, remaining)
+
+
+def _fetch_rows(
+    query_id: str,
+    max_rows: int | None = None,
+    prefetch: bool = RESULT_PREFETCH,
+) -> tuple[List[List[str | None]], List[Dict[str, Any]]]:
+    """
+    Return (data_rows, column_info) across all pages, header excluded.
+    `max_rows` stops fetching once that many rows are collected.
+    """
+    data: List[List[str | None]] = []
+    column_info: List[Dict[str, Any]] = []
+
+    for page_info, rows, _ in _iter_result_pages(
+        query_id, max_rows=max_rows, prefetch=prefetch
+    ):
+        column_info = column_info or page_info
+        data.extend(rows)
+
+    if max_rows is not None:
+        data = data[:max_rows]
+    return data, column_info
+
+
+def _fetch_page(
+    query_id: str,
+    max_rows: int,
+    next_token: str | None = None,
+    prefetch: bool = RESULT_PREFETCH,
+    header: bool | None = None,
+) -> tuple[List[List[str | None]], List[Dict[str, Any]], str | None]:
+    """
+    Blocking: up to `max_rows` rows starting at `next_token` (None = the
+    first row), as (rows, column_info, next_token); next_token is None once
+    the result is exhausted. `header` as for _iter_result_pages.
+    """
+    data: List[List[str | None]] = []
+    column_info: List[Dict[str, Any]] = []
+    token = None
+    for page_info, rows, token in _iter_result_pages(
+        query_id, max_rows=max_rows, next_token=next_token, prefetch=prefetch, header=header
+    ):
+        column_info = column_info or page_info
+        data.extend(rows)
+    return data[:max_rows], column_info, token
+
+
+def _result_has_header(wait_stats: Dict[str, Any]) -> bool | None:
+    """SELECT (DML) results start with a header row, SHOW / DESCRIBE ones don't."""
+    statement_type = wait_stats.get("statement_type")
+    return statement_type == "DML" if statement_type else None
+
+
+def _get_rows_raw(
+    query_id: str,
+    max_rows: int | None = None,
+    prefetch: bool = RESULT_PREFETCH,
+):
+    """
+    Return rows (excluding header) and column names, across all pages.
+
+    Args:
+        max_rows: stop fetching once this many rows are collected
+                  (None = the whole result).
+
+    Returns:
+        (data_rows, columns)
+            data_rows: List[List[str | None]]
+            columns:   List[str]
+    """
+    data, column_info = _fetch_rows(query_id, max_rows, prefetch)
+    return data, _column_names(column_info)
+
+
+# --------------------------------------------------------------------
+# S3 result-file reader
+# --------------------------------------------------------------------
+
+# Athena CSV quotes every non-null value and leaves NULLs empty; the csv
+# module tells the two apart from Python 3.12 on (None before that).
+_CSV_QUOTE_NOTNULL = getattr(csv, "QUOTE_NOTNULL", None)
+_CSV_FIELD_RE = re.compile(r'(?:^|,)(?:(")([^"]*(?:""[^"]*)*)"|)')
+
+
+def _parse_csv_record(record: str) -> List[str | None]:
+    """One Athena CSV record (line ending stripped); unquoted empty fields are NULL."""
+    if record[:1] == '"' and record[-1:] == '"' and '""' not in record and ",," not in record:
+        # No NULLs and no escaped quotes: every field is "...".
+        return record[1:-1].split('","')
+    return [
+        value.replace('""', '"') if quote else None
+        for quote, value in _CSV_FIELD_RE.findall(record)
+    ]
+
+
+def _read_athena_csv(lines: Iterator[str]) -> Iterator[List[str | None]]:
+    """Rows of an Athena result CSV with NULL as None and '' as ''."""
+    if _CSV_QUOTE_NOTNULL is not None:
+        yield from csv.reader(lines, quoting=_CSV_QUOTE_NOTNULL)
+        return
+    record, quotes = "", 0
+    for line in lines:
+        record += line
+        quotes += line.count('"')
+        if quotes % 2:
+            continue  # inside a quoted multi-line value
+        yield _parse_csv_record(record.rstrip("\r\n"))
+        record, quotes = "", 0
+    if record:
+        yield _parse_csv_record(record.rstrip("\r\n"))
+
+
+def _split_s3_uri(uri: str) -> tuple[str, str]:
+    if not uri.startswith("s3://"):
+        raise ValueError(f"Not an S3 URI: {uri}")
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def _iter_text_lines(body, chunk_size: int) -> Iterator[str]:
+    """
+    Decode a streaming body chunk by chunk into lines (line endings kept, so
+    quoted multi-line CSV fields survive). Memory stays at ~one chunk.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in body.iter_chunks(chunk_size):
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _result_column_info(query_id: str) -> List[Dict[str, Any]]:
+    """Blocking: ResultSetMetadata.ColumnInfo of a finished query (1-row fetch)."""
+    resp = get_athena_client().get_query_results(QueryExecutionId=query_id, MaxResults=1)
+    return resp["ResultSet"].get("ResultSetMetadata", {}).get("ColumnInfo", [])
+
+
+def _fetch_rows_s3(
+    query_id: str,
+    output_location: str,
+    max_rows: int | None = None,
+    offset: int = 0,
+) -> tuple[List[List[str | None]], List[Dict[str, Any]]]:
+    """
+    Blocking: read (data_rows, column_info) from the result CSV on S3,
+    parsing it incrementally and closing the stream after `max_rows` rows
+    (skipping the first `offset` data rows).
+    """
+    bucket, key = _split_s3_uri(output_location)
+    column_info_future = _prefetch_executor.submit(_result_column_info, query_id)
+
+    body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        reader = _read_athena_csv(_iter_text_lines(body, S3_READ_CHUNK_BYTES))
+        header = next(reader, [])
+        stop = None if max_rows is None else offset + max_rows
+        rows = list(itertools.islice(reader, offset, stop))
+    finally:
+        body.close()
+
+    column_info = column_info_future.result() or [{"Name": name} for name in header]
+    return rows, column_info
+
+
+def _use_s3_fastpath(wait_stats: Dict[str, Any], max_rows: int) -> bool:
+    """Stream from S3 for large SELECT results that have a CSV result file."""
+    return (
+        S3_FASTPATH_MIN_ROWS > 0
+        and max_rows >= S3_FASTPATH_MIN_ROWS
+        and wait_stats.get("statement_type") == "DML"
+        and wait_stats.get("output_location", "").endswith(".csv")
+    )
+
+
+# --------------------------------------------------------------------
+# Typed result decoding
+# --------------------------------------------------------------------
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() == "true"
+
+
+def _parse_timestamp(value: str) -> datetime:
+    # "2024-05-01 12:34:56.789"; zone-qualified values ("... UTC") stay text.
+    return datetime.fromisoformat(value)
+
+
+_TYPE_DECODERS: Dict[str, Callable[[str], Any]] = {
+    "tinyint": int,
+    "smallint": int,
+    "integer": int,
+    "int": int,
+    "bigint": int,
+    "double": float,
+    "float": float,
+    "real": float,
+    "decimal": Decimal,
+    "boolean": _parse_bool,
+    "date": date.fromisoformat,
+    "timestamp": _parse_timestamp,
+}
+
+
+def _column_decoder(athena_type: str) -> Callable[[str | None], Any] | None:
+    """
+    Null-safe decoder for an Athena ColumnInfo.Type, or None when values
+    should stay strings (varchar, arrays, maps, json, ...). Values that fail
+    to parse are passed through unchanged.
+    """
+    base = re.split(r"[(\s]", athena_type.strip().lower(), maxsplit=1)[0]
+    if athena_type.strip().lower().startswith("timestamp with time zone"):
+        return None
+    parse = _TYPE_DECODERS.get(base)
+    if parse is None:
+        return None
+
+    def decode(value: str | None) -> Any:
+        if value is None:
+            return None
+        try:
+            return parse(value)
+        except (ValueError, InvalidOperation):
+            return value
+
+    return decode
+
+
+def _decode_columns(
+    column_info: List[Dict[str, Any]],
+    rows: List[List[str | None]],
+) -> List[List[Any]]:
+    """
+    Decode VarCharValue rows into native values, one column at a time:
+    each column is transposed out, mapped through a single decoder chosen
+    from ResultSetMetadata, and returned as a list per column.
+    """
+    width = len(column_info) or (len(rows[0]) if rows else 0)
+    columns = [list(col) for col in zip(*rows)] if rows else [[] for _ in range(width)]
+    for i, info in enumerate(column_info[: len(columns)]):
+        decoder = _column_decoder(info.get("Type", "varchar"))
+        if decoder is not None:
+            columns[i] = list(map(decoder, columns[i]))
+    return columns
+
+
+def is_safe_readonly_query(sql: str) -> tuple[bool, str | None]:
+    """
+    Check if SQL is safe read-only query.
+    Returns (is_safe, error_message)
+    """
+    error = _analyze_sql(sql).error
+    return error is None, error
+
+
+def _shape_result(
+    rows: List[List[str | None]],
+    column_info: List[Dict[str, Any]],
+    typed: bool,
+    columnar: bool,
+) -> List[Dict[str, Any]] | Dict[str, List[Any]]:
+    """Blocking: decode rows and shape them as row dicts or per-column lists."""
+    names = _column_names(column_info)
+    if typed:
+        columns = _decode_columns(column_info, rows)
+        if columnar:
+            return dict(zip(names, columns))
+        return [dict(zip(names, row)) for row in zip(*columns)]
+    if columnar:
+        return {name: [r[i] for r in rows] for i, name in enumerate(names)}
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _row_count(result: List[Dict[str, Any]] | Dict[str, List[Any]]) -> int:
+    if isinstance(result, dict):
+        return len(next(iter(result.values()), []))
+    return len(result)
+
+
+# --------------------------------------------------------------------
+# Result cache
+# --------------------------------------------------------------------
+
+class _ResultCache:
+    """
+    Thread-safe LRU of query results bounded by total (JSON-encoded) size,
+    with a TTL per entry. Hits/misses/evictions go to _metrics.
+    """
+
+    def __init__(self, max_bytes: int, ttl_sec: float):
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        # key -> (expires_at, size_bytes, value)
+        self._entries: OrderedDict[tuple, tuple[float, int, Any]] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl_sec > 0
+
+    def get(self, key: tuple) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                _metrics.inc("result_cache_misses_total")
+                return None
+            self._entries.move_to_end(key)
+        _metrics.inc("result_cache_hits_total")
+        return entry[2]
+
+    def put(self, key: tuple, value: Any) -> None:
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl_sec, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                _metrics.inc("result_cache_evictions_total")
+            _metrics.set("result_cache_bytes", self._bytes)
+            _metrics.set("result_cache_entries", len(self._entries))
+
+    def _drop(self, key: tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+_result_cache = _ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_SEC)
+
+
+def _result_cache_key(database: str, sql: str, max_rows: int, *variant) -> tuple | None:
+    """
+    Cache key for a query, or None if its results must not be cached.
+    `variant` distinguishes output shapes of the same result.
+    """
+    analysis = _analyze_sql(sql)
+    if not _result_cache.enabled or analysis.volatile:
+        return None
+    return (database.lower(), analysis.normalized, max_rows, *variant)
+
+
+class _CursorStore:
+    """
+    Server-side cursors over query results that were cut off at max_rows:
+    where to resume (GetQueryResults NextToken, or a row offset into the
+    S3 result CSV) plus the column info and output shape. Entries expire
+    after CURSOR_IDLE_TTL_SEC without use and are evicted LRU beyond
+    CURSOR_MAX_BYTES (JSON-encoded size). Event-loop only.
+    """
+
+    def __init__(self, max_bytes: int, idle_ttl_sec: float):
+        self.max_bytes = max_bytes
+        self.idle_ttl_sec = idle_ttl_sec
+        # cursor id -> (last_used, size_bytes, state)
+        self._entries: OrderedDict[str, tuple[float, int, Dict[str, Any]]] = OrderedDict()
+        self._bytes = 0
+
+    def open(self, state: Dict[str, Any]) -> str | None:
+        """Register a cursor for `state` and return its id (None if disabled)."""
+        if self.max_bytes <= 0:
+            return None
+        self._expire()
+        cursor = uuid.uuid4().hex
+        state = dict(state, busy=asyncio.Lock())
+        size = len(json.dumps({k: v for k, v in state.items() if k != "busy"}, default=str))
+        self._entries[cursor] = (time.monotonic(), size, state)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self.close(next(iter(self._entries)))
+            _metrics.inc("cursor_evictions_total")
+        self._publish()
+        return cursor
+
+    def get(self, cursor: str) -> Dict[str, Any] | None:
+        self._expire()
+        entry = self._entries.get(cursor)
+        if entry is None:
+            return None
+        self._entries[cursor] = (time.monotonic(), entry[1], entry[2])
+        self._entries.move_to_end(cursor)
+        return entry[2]
+
+    def close(self, cursor: str) -> None:
+        entry = self._entries.pop(cursor, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            self._publish()
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.idle_ttl_sec
+        while self._entries:
+            cursor, (last_used, _, _) = next(iter(self._entries.items()))
+            if last_used >= cutoff:
+                break
+            self.close(cursor)
+            _metrics.inc("cursor_expired_total")
+
+    def _publish(self) -> None:
+        _metrics.set("cursors_open", len(self._entries))
+        _metrics.set("cursor_bytes", self._bytes)
+
+
+_cursors = _CursorStore(CURSOR_MAX_BYTES, CURSOR_IDLE_TTL_SEC)
+
+
+# --------------------------------------------------------------------
+# Parquet export (UNLOAD)
+# --------------------------------------------------------------------
+
+
+class _S3RangeReader(io.RawIOBase):
+    """
+    Seekable read-only file over an S3 object using ranged GETs, so pyarrow
+    only downloads the Parquet footer and the column chunks it reads.
+    """
+
+    def __init__(self, bucket: str, key: str, size: int):
+        super().__init__()
+        self._bucket, self._key, self._size = bucket, key, size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size or len(buffer) == 0:
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        data = get_s3_client().get_object(
+            Bucket=self._bucket, Key=self._key, Range=f"bytes={self._pos}-{end}"
+        )["Body"].read()
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _unload_statement(sql: str, location: str) -> str:
+    """Wrap a validated SELECT in UNLOAD ... TO location as Parquet."""
+    return (
+        f"UNLOAD ({_statement_text(sql)}) TO '{location}' "
+        "WITH (format = 'PARQUET', compression = 'SNAPPY')"
+    )
+
+
+def _read_parquet_export(
+    location: str,
+    preview_rows: int,
+    columns: List[str] | None,
+) -> Dict[str, Any]:
+    """
+    Blocking: summarize the Parquet files under an UNLOAD location.
+
+    Row counts and schema come from the file footers; only the requested
+    columns of the first row groups are read for the preview.
+    """
+    bucket, prefix = _split_s3_uri(location)
+    objects = [
+        obj
+        for page in get_s3_client().get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        )
+        for obj in page.get("Contents", [])
+        if obj["Size"] > 0
+    ]
+
+    def open_file(obj: Dict[str, Any]):
+        return pq.ParquetFile(_S3RangeReader(bucket, obj["Key"], obj["Size"]))
+
+    files = list(_prefetch_executor.map(open_file, objects))
+
+    schema: List[Dict[str, str]] = []
+    if files:
+        arrow_schema = files[0].schema_arrow
+        schema = [{"name": f.name, "type": str(f.type)} for f in arrow_schema]
+
+    preview: Dict[str, List[Any]] = {}
+    remaining = preview_rows
+    for parquet_file in files:
+        for group in range(parquet_file.num_row_groups):
+            if remaining <= 0:
+                break
+            table = parquet_file.read_row_group(group, columns=columns)
+            chunk = table.slice(0, remaining).to_pydict()
+            for name, values in chunk.items():
+                preview.setdefault(name, []).extend(values)
+            remaining -= min(table.num_rows, remaining)
+
+    return {
+        "location": location,
+        "files": [f"s3://{bucket}/{obj['Key']}" for obj in objects],
+        "total_bytes": sum(obj["Size"] for obj in objects),
+        "row_count": sum(f.metadata.num_rows for f in files),
+        "schema": schema,
+        "preview": preview,
+    }
+
+
+# --------------------------------------------------------------------
+# Table metadata (Glue Data Catalog, Athena fallback)
+# --------------------------------------------------------------------
+
+
+def _glue_column(col: Dict[str, Any], partition_key: bool) -> Dict[str, Any]:
+    return {
+        "name": col["Name"],
+        "type": col.get("Type", ""),
+        "comment": col.get("Comment", ""),
+        "partition_key": partition_key,
+    }
+
+
+def _glue_table_columns(table: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Regular columns followed by partition keys (flagged) of a Glue table."""
+    columns = table.get("StorageDescriptor", {}).get("Columns", [])
+    return [_glue_column(c, False) for c in columns] + [
+        _glue_column(c, True) for c in table.get("PartitionKeys", [])
+    ]
+
+
+_COLUMNAR_FORMATS = ("parquet", "orc")
+
+
+def _glue_table_stats(table: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Size statistics of a Glue table, as written by crawlers / Hive
+    (sizeKey, totalSize, recordCount x averageRecordSize); size_bytes is
+    None when the catalog has none.
+    """
+    params = table.get("Parameters", {})
+    storage = table.get("StorageDescriptor", {})
+    size = None
+    for key in ("sizeKey", "totalSize", "rawDataSize"):
+        try:
+            size = int(params[key])
+            break
+        except (KeyError, ValueError):
+            continue
+    if size is None:
+        try:
+            size = int(float(params["recordCount"]) * float(params["averageRecordSize"]))
+        except (KeyError, ValueError):
+            pass
+    fmt = " ".join(
+        (params.get("classification", ""), storage.get("InputFormat", ""))
+    ).lower()
+    return {
+        "size_bytes": size,
+        "columnar": any(f in fmt for f in _COLUMNAR_FORMATS),
+    }
+
+
+def _glue_iter_tables(database: str) -> Iterator[Dict[str, Any]]:
+    """Blocking: page through glue:GetTables for a database."""
+    paginator = get_glue_client().get_paginator("get_tables")
+    for page in paginator.paginate(DatabaseName=database):
+        yield from page.get("TableList", [])
+
+
+def _glue_iter_databases() -> Iterator[str]:
+    """Blocking: page through glue:GetDatabases."""
+    paginator = get_glue_client().get_paginator("get_databases")
+    for page in paginator.paginate():
+        for db in page.get("DatabaseList", []):
+            yield db["Name"]
+
+
+_IDENTIFIER_PART = re.compile(r"[a-z0-9]+")
+_CAMEL_BOUNDARY = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def _search_tokens(text: str) -> set[str]:
+    """Lowercased words of an identifier/comment: 'accountId_2' -> account, id, 2."""
+    return set(_IDENTIFIER_PART.findall(_CAMEL_BOUNDARY.sub(r"\1 \2", text).lower()))
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _SchemaIndex:
+    """
+    Inverted index over table names, column names, types and comments of
+    every cached database, kept in sync by _SchemaCache.
+
+    Each table and each column is one document. Postings map word tokens and
+    character trigrams to document ids, so a term is answered by set
+    intersections instead of a scan: exact token hits rank first, then
+    substrings (trigram candidates, verified), then fuzzy name matches
+    (trigram overlap) for misspellings.
+
+    update() diffs a database against what is indexed by a per-table
+    signature, so a catalog refresh only re-indexes tables that changed.
+    """
+
+    # Minimum trigram similarity (Dice) between a term and a word of a name
+    # to count as a fuzzy match ("salery" -> "salary").
+    FUZZY_MIN_SIMILARITY = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._tokens: Dict[str, set[int]] = defaultdict(set)
+        self._trigrams: Dict[str, set[int]] = defaultdict(set)
+        # database -> table -> (signature, doc ids)
+        self._tables: Dict[str, Dict[str, tuple[str, List[int]]]] = defaultdict(dict)
+
+    # -- maintenance --------------------------------------------------
+
+    @staticmethod
+    def _signature(columns: List[Dict[str, Any]]) -> str:
+        return hashlib.sha1(json.dumps(columns, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _add_doc(self, doc: Dict[str, Any]) -> int:
+        doc_id = next(self._ids)
+        name = (doc["column"] or doc["table"]).lower()
+        doc["name"] = name
+        doc["text"] = " ".join(filter(None, (name, doc.get("type", ""), doc.get("comment", "")))).lower()
+        self._docs[doc_id] = doc
+        for token in _search_tokens(doc["text"]) | {name}:
+            self._tokens[token].add(doc_id)
+        for gram in _trigrams(doc["text"]):
+            self._trigrams[gram].add(doc_id)
+        return doc_id
+
+    def _remove_doc(self, doc_id: int) -> None:
+        doc = self._docs.pop(doc_id)
+        for token in _search_tokens(doc["text"]) | {doc["name"]}:
+            self._discard(self._tokens, token, doc_id)
+        for gram in _trigrams(doc["text"]):
+            self._discard(self._trigrams, gram, doc_id)
+
+    @staticmethod
+    def _discard(postings: Dict[str, set[int]], key: str, doc_id: int) -> None:
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del postings[key]
+
+    def update(self, database: str, tables: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Re-index the tables of `database` that were added, changed or dropped."""
+        changes = {"added": 0, "changed": 0, "removed": 0}
+        with self._lock:
+            indexed = self._tables[database]
+            for table in indexed.keys() - tables.keys():
+                _, doc_ids = indexed.pop(table)
+                for doc_id in doc_ids:
+                    self._remove_doc(doc_id)
+                changes["removed"] += 1
+
+            for table, columns in tables.items():
+                signature = self._signature(columns)
+                current = indexed.get(table)
+                if current is not None and current[0] == signature:
+                    continue
+                if current is not None:
+                    for doc_id in current[1]:
+                        self._remove_doc(doc_id)
+                changes["changed" if current is not None else "added"] += 1
+                doc_ids = [self._add_doc({"database": database, "table": table, "column": None})]
+                for col in columns:
+                    doc_ids.append(self._add_doc({
+                        "database": database,
+                        "table": table,
+                        "column": col["name"],
+                        "type": col.get("type", ""),
+                        "comment": col.get("comment", ""),
+                        "partition_key": col.get("partition_key", False),
+                    }))
+                indexed[table] = (signature, doc_ids)
+            documents = len(self._docs)
+
+        for change, count in changes.items():
+            if count:
+                _metrics.inc("schema_index_table_updates_total", count, change=change)
+        _metrics.set("schema_index_documents", documents)
+
+    # -- search -------------------------------------------------------
+
+    def _term_hits(self, term: str) -> Dict[int, float]:
+        hits: Dict[int, float] = {}
+        for doc_id in self._tokens.get(term, ()):
+            hits[doc_id] = 4.0 if self._docs[doc_id]["name"] == term else 3.0
+
+        grams = _trigrams(term)
+        if grams:
+            postings = sorted((self._trigrams.get(g, set()) for g in grams), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        else:  # too short for trigrams: verify every document
+            candidates = self._docs.keys()
+        for doc_id in candidates - hits.keys():
+            doc = self._docs[doc_id]
+            if term in doc["name"]:
+                hits[doc_id] = 2.0
+            elif term in doc["text"]:
+                hits[doc_id] = 1.0
+
+        if not hits and len(grams) >= 2:
+            padded = _trigrams(f" {term} ")
+            candidates = set().union(*(self._trigrams.get(g, ()) for g in grams))
+            for doc_id in candidates:
+                # Dice coefficient against the closest word of the name.
+                words = (_trigrams(f" {w} ") for w in _search_tokens(self._docs[doc_id]["name"]))
+                score = max(
+                    (2 * len(padded & word) / (len(padded) + len(word)) for word in words),
+                    default=0.0,
+                )
+                if score >= self.FUZZY_MIN_SIMILARITY:
+                    hits[doc_id] = score
+        return hits
+
+    def search(
+        self, pattern: str, databases: set[str] | None, limit: int
+    ) -> tuple[List[Dict[str, Any]], int]:
+        """Documents matching every term of `pattern`, best first, and the total count."""
+        terms = [t for t in re.split(r"[\s%*]+", pattern.strip().lower()) if t]
+        if not terms:
+            return [], 0
+        with self._lock:
+            scores: Dict[int, float] | None = None
+            for term in terms:
+                hits = self._term_hits(term)
+                if scores is None:
+                    scores = hits
+                else:
+                    scores = {d: scores[d] + hits[d] for d in scores.keys() & hits.keys()}
+                if not scores:
+                    return [], 0
+            if databases is not None and not databases.issuperset(self._tables):
+                scores = {
+                    d: score for d, score in scores.items()
+                    if self._docs[d]["database"] in databases
+                }
+            # Ties keep catalog order (doc ids are assigned in sweep order).
+            top = heapq.nsmallest(limit, scores.items(), key=lambda ds: (-ds[1], ds[0]))
+            best = [(score, self._docs[d]) for d, score in top]
+
+        matches = []
+        for score, doc in best:
+            match = {"database": doc["database"], "table": doc["table"]}
+            if doc["column"] is not None:
+                match.update(
+                    column=doc["column"],
+                    type=doc["type"],
+                    comment=doc["comment"],
+                    partition_key=doc["partition_key"],
+                )
+            match["score"] = round(score, 2)
+            matches.append(match)
+        return matches, len(scores)
+
+
+class _SchemaCache:
+    """
+    databases -> tables -> columns, filled from one glue:GetTables sweep per
+    database.
+
+    Fresh entries (younger than SCHEMA_TTL_SEC) are served directly; stale
+    ones are served immediately while a background refresh runs
+    (stale-while-revalidate); entries past SCHEMA_MAX_STALE_SEC, or missing,
+    are fetched inline. Every fetch is persisted to the snapshot file and
+    fed to the search index.
+    """
+
+    # A table missing from a cached database triggers an inline re-fetch at
+    # most this often (it may have been created since).
+    MISSING_TABLE_REFRESH_SEC = 30
+
+    def __init__(
+        self, ttl_sec: float, max_stale_sec: float, snapshot_path: str, index: _SchemaIndex
+    ):
+        self.ttl_sec = ttl_sec
+        self.max_stale_sec = max_stale_sec
+        self.snapshot_path = snapshot_path
+        self.index = index
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        # database -> {"fetched_at": epoch seconds, "tables": {name: columns}}
+        self._databases: Dict[str, Dict[str, Any]] = {}
+        self._refreshing: set[str] = set()
+        self._loaded = False
+        # (fetched_at, database names) from glue:GetDatabases
+        self._database_names: tuple[float, List[str]] | None = None
+
+    # -- snapshot file ------------------------------------------------
+
+    def _ensure_loaded(self) -> None:
+        """Blocking: load the snapshot file and index it (once)."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+                return
+            try:
+                with open(self.snapshot_path, encoding="utf-8") as f:
+                    self._databases.update(json.load(f).get("databases", {}))
+            except (OSError, ValueError) as exc:
+                _log.warning("ignoring unreadable schema snapshot: %s", exc)
+            for database, entry in self._databases.items():
+                self.index.update(database, entry["tables"])
+
+    def _save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            payload = {"version": 1, "databases": dict(self._databases)}
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with self._snapshot_lock:
+            try:
+                os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(payload, f)
+                os.replace(tmp_path, self.snapshot_path)
+            except OSError as exc:
+                _log.warning("could not write schema snapshot: %s", exc)
+
+    # -- fetching -----------------------------------------------------
+
+    def _fetch(self, database: str, save: bool = True) -> Dict[str, Any]:
+        """Blocking: sweep a database from Glue and store it (and the snapshot)."""
+        started = time.monotonic()
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        stats: Dict[str, Dict[str, Any]] = {}
+        for t in _glue_iter_tables(database):
+            tables[t["Name"].lower()] = _glue_table_columns(t)
+            stats[t["Name"].lower()] = _glue_table_stats(t)
+        entry = {"fetched_at": time.time(), "tables": tables, "stats": stats}
+        with self._lock:
+            self._databases[database] = entry
+        self.index.update(database, tables)
+        _metrics.inc("schema_cache_fetches_total")
+        _metrics.inc("schema_cache_fetch_ms_total", (time.monotonic() - started) * 1000)
+        if save:
+            self._save_snapshot()
+        return entry
+
+    def _refresh(self, databases: List[str]) -> None:
+        refreshed = False
+        for database in databases:
+            try:
+                self._fetch(database, save=False)
+                refreshed = True
+            except Exception as exc:
+                _log.warning("background schema refresh of %s failed: %s", database, exc)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(database)
+        if refreshed:
+            self._save_snapshot()
+
+    def _refresh_in_background(self, databases: List[str]) -> None:
+        with self._lock:
+            databases = [db for db in databases if db not in self._refreshing]
+            self._refreshing.update(databases)
+        if databases:
+            _schema_executor.submit(self._refresh, databases)
+
+    async def _run_fetch(self, database: str, save: bool = True) -> Dict[str, Any]:
+        """_fetch on the schema pool, coalesced with concurrent fetches of `database`."""
+        loop = asyncio.get_running_loop()
+        entry, _ = await _schema_flights.run(
+            (database,),
+            lambda: loop.run_in_executor(
+                _schema_executor, functools.partial(self._fetch, database, save)
+            ),
+        )
+        return entry
+
+    async def _entry(self, database: str, max_age_sec: float | None = None) -> Dict[str, Any]:
+        if not self._loaded:
+            # Parsing and indexing a large snapshot takes seconds.
+            await _run_blocking(self._ensure_loaded)
+        with self._lock:
+            entry = self._databases.get(database)
+        age = time.time() - entry["fetched_at"] if entry else None
+
+        if entry is None or age > (max_age_sec if max_age_sec is not None else self.max_stale_sec):
+            _metrics.inc("schema_cache_misses_total")
+            return await self._run_fetch(database)
+
+        if age > self.ttl_sec:
+            _metrics.inc("schema_cache_stale_hits_total")
+            self._refresh_in_background([database])
+        else:
+            _metrics.inc("schema_cache_hits_total")
+        return entry
+
+    # -- lookups ------------------------------------------------------
+
+    async def tables(self, database: str) -> Dict[str, List[Dict[str, Any]]]:
+        """{table name: columns} for a database."""
+        return (await self._entry(database))["tables"]
+
+    async def sweep(
+        self, databases: List[str]
+    ) -> List[Dict[str, List[Dict[str, Any]]] | BaseException]:
+        """
+        tables() of many databases at once (catalog-wide search), each item
+        the tables or the exception that kept them from loading. Missing
+        databases are fetched SCHEMA_FETCH_CONCURRENCY at a time, stale ones
+        refreshed by one background job, and the snapshot is written once.
+        """
+        if not self._loaded:
+            await _run_blocking(self._ensure_loaded)
+        now = time.time()
+        with self._lock:
+            ages = {
+                db: now - self._databases[db]["fetched_at"]
+                for db in databases
+                if db in self._databases
+            }
+        missing = [db for db in databases if ages.get(db, math.inf) > self.max_stale_sec]
+        stale = [db for db in databases if self.ttl_sec < ages.get(db, math.inf) <= self.max_stale_sec]
+        _metrics.inc("schema_cache_misses_total", len(missing))
+        _metrics.inc("schema_cache_stale_hits_total", len(stale))
+        _metrics.inc("schema_cache_hits_total", len(databases) - len(missing) - len(stale))
+
+        fetched = await asyncio.gather(
+            *(self._run_fetch(db, save=False) for db in missing), return_exceptions=True
+        )
+        if any(not isinstance(entry, BaseException) for entry in fetched):
+            await asyncio.get_running_loop().run_in_executor(
+                _schema_executor, self._save_snapshot
+            )
+        if stale:
+            self._refresh_in_background(stale)
+
+        results = dict(zip(missing, fetched))
+        with self._lock:
+            for db in databases:
+                if db not in results:
+                    results[db] = self._databases[db]
+        return [
+            entry if isinstance(entry, BaseException) else entry["tables"]
+            for entry in (results[db] for db in databases)
+        ]
+
+    async def columns(self, database: str, table: str) -> List[Dict[str, Any]] | None:
+        """Columns of one table, or None if the catalog doesn't have it."""
+        name = table.strip('"`').lower()
+        columns = (await self._entry(database))["tables"].get(name)
+        if columns is None:
+            entry = await self._entry(database, max_age_sec=self.MISSING_TABLE_REFRESH_SEC)
+            columns = entry["tables"].get(name)
+        return columns
+
+    async def table_stats(self, database: str, table: str) -> Dict[str, Any] | None:
+        """Size statistics of one table (see _glue_table_stats), if cataloged."""
+        name = table.strip('"`').lower()
+        return (await self._entry(database)).get("stats", {}).get(name)
+
+    async def databases(self) -> List[str]:
+        """Names of all catalog databases (re-listed after SCHEMA_TTL_SEC)."""
+        cached = self._database_names
+        if cached is not None and time.time() - cached[0] <= self.ttl_sec:
+            return cached[1]
+        names, _ = await _schema_flights.run(
+            ("__databases__",), lambda: _run_blocking(lambda: list(_glue_iter_databases()))
+        )
+        self._database_names = (time.time(), names)
+        return names
+
+
+_schema_index = _SchemaIndex()
+_schema_cache = _SchemaCache(
+    SCHEMA_TTL_SEC, SCHEMA_MAX_STALE_SEC, SCHEMA_SNAPSHOT_PATH, _schema_index
+)
+_schema_flights = _SingleFlight("schema")
+
+
+async def _athena_list_tables(database: str, reuse_max_age_minutes: int | None) -> List[str]:
+    query = f"SHOW TABLES IN {database}"
+    _log.debug("list_tables: %s", query)
+
+    qid, _, _ = await _run_query(
+        database, query, _reuse_max_age("list_tables", reuse_max_age_minutes)
+    )
+
+    rows, _ = await _run_blocking(_get_rows_raw, qid)
+    return [r[0] for r in rows if r and r[0]]
+
+
+async def _athena_describe_table(
+    database: str,
+    table: str,
+    reuse_max_age_minutes: int | None,
+) -> List[Dict[str, Any]]:
+    query = f"DESCRIBE {table}"
+    _log.debug("describe_table: %s (db=%s)", query, database)
+
+    qid, _, _ = await _run_query(
+        database, query, _reuse_max_age("describe_table", reuse_max_age_minutes)
+    )
+
+    rows, _ = await _run_blocking(_get_rows_raw, qid)
+
+    result: List[Dict[str, Any]] = []
+    partition_names: set[str] = set()
+    in_partition_section = False
+    for r in rows:
+        # Athena returns DESCRIBE output as tab-separated text in one column.
+        if len(r) == 1 and r[0] and "\t" in r[0]:
+            r = r[0].split("\t")
+        r = [(v or "").strip() for v in r]
+        if not r or not r[0]:
+            continue
+        if r[0].startswith("#"):
+            in_partition_section = in_partition_section or "partition" in r[0].lower()
+            continue
+        if in_partition_section:
+            partition_names.add(r[0])
+            continue
+        name = r[0]
+        dtype = r[1] if len(r) > 1 else ""
+        comment = r[2] if len(r) > 2 else ""
+        result.append({"name": name, "type": dtype, "comment": comment})
+
+    for col in result:
+        col["partition_key"] = col["name"] in partition_names
+    return result
+
+
+def _use_glue() -> bool:
+    return METADATA_BACKEND == "glue"
+
+
+def _glue_access_denied(exc: ClientError) -> bool:
+    return exc.response.get("Error", {}).get("Code") in (
+        "AccessDeniedException",
+        "UnauthorizedOperation",
+    )
+
+
+# How Athena reports DESCRIBE of a table that doesn't exist (Hive / Trino engines)
+_TABLE_NOT_FOUND_RE = re.compile(r"table not found|table_not_found|does not exist", re.I)
+
+
+def _table_not_found(exc: BaseException) -> bool:
+    """True if a failed Athena DESCRIBE means the table is missing (not throttling etc.)."""
+    return isinstance(exc, RuntimeError) and bool(_TABLE_NOT_FOUND_RE.search(str(exc)))
+
+
+# --------------------------------------------------------------------
+# Scan guard (pre-flight scan estimate, per-session byte budget)
+# --------------------------------------------------------------------
+
+
+class _ScanBudget:
+    """
+    Bytes Athena scanned for this server process, i.e. this MCP session
+    (each stdio client starts its own server), against a budget.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+
+    def charge(self, scanned_bytes: int) -> None:
+        if not scanned_bytes:
+            return
+        with self._lock:
+            self.used_bytes += scanned_bytes
+            used = self.used_bytes
+        _metrics.set("session_scanned_bytes", used)
+
+    def remaining(self) -> int | None:
+        if self.budget_bytes <= 0:
+            return None
+        with self._lock:
+            return max(self.budget_bytes - self.used_bytes, 0)
+
+
+_scan_budget = _ScanBudget(SESSION_SCAN_BUDGET_BYTES)
+
+def _column_fraction(sql: str, columns: List[Dict[str, Any]]) -> float:
+    """
+    Share of a columnar table's data columns a query mentions (Parquet/ORC
+    only read those); 1.0 for SELECT *.
+    """
+    analysis = _analyze_sql(sql)
+    data_columns = [c["name"].lower() for c in columns if not c.get("partition_key")]
+    if analysis.select_star or not data_columns:
+        return 1.0
+    used = sum(1 for name in data_columns if name in analysis.identifiers)
+    return max(used, 1) / len(data_columns)
+
+
+async def _glue_scan_estimate(database: str, sql: str) -> int | None:
+    """
+    Sum of the Glue size statistics of the tables a query reads (scaled
+    down for TABLESAMPLE SYSTEM, which skips whole files).
+    """
+    fractions: Dict[tuple[str, str], float] = {}
+    for ref in _analyze_sql(sql).tables:
+        key = (ref.database or database, ref.table)
+        fractions[key] = max(fractions.get(key, 0.0), _sample_fraction(ref))
+
+    total, found = 0, False
+    for (db, table), fraction in fractions.items():
+        stats = await _schema_cache.table_stats(db, table)
+        if stats is None:
+            continue  # CTE, view or unknown table
+        found = True
+        if stats["size_bytes"] is None:
+            return None  # a real table without statistics: can't tell
+        size = stats["size_bytes"] * fraction
+        if stats["columnar"]:
+            size *= _column_fraction(sql, await _schema_cache.columns(db, table) or [])
+        total += int(size)
+    return total if found else None
+
+
+def _explain_io_bytes(plan: Dict[str, Any]) -> int | None:
+    """Input bytes from EXPLAIN (TYPE IO, FORMAT JSON); None if not estimated."""
+    if not isinstance(plan, dict):
+        return None
+    sizes = [
+        info.get("estimate", {}).get("outputSizeInBytes")
+        for info in plan.get("inputTableColumnInfos", [])
+    ]
+    if not sizes or any(
+        not isinstance(s, (int, float)) or s != s for s in sizes  # NaN: no stats
+    ):
+        return None
+    return int(sum(sizes))
+
+
+async def _explain_scan_estimate(database: str, sql: str) -> int | None:
+    """Ask the engine: EXPLAIN (TYPE IO) costs a round-trip but scans nothing."""
+    qid, _, _ = await _run_query(
+        database, f"EXPLAIN (TYPE IO, FORMAT JSON) {_statement_text(sql)}"
+    )
+    rows, _ = await _run_blocking(_get_rows_raw, qid)
+    text = "\n".join(r[0] for r in rows if r and r[0])
+    try:
+        return _explain_io_bytes(json.loads(text))
+    except ValueError:
+        return None
+
+
+async def _estimate_scan_bytes(database: str, sql: str) -> tuple[int | None, str]:
+    """
+    Pre-flight estimate of the bytes a query will scan, and its source:
+    "history" (the same query shape ran before), "glue" (table size
+    statistics), "explain" (EXPLAIN (TYPE IO)) or "unknown". Only queries
+    are estimated (SHOW / DESCRIBE scan nothing), and an estimate that
+    fails for any reason is "unknown".
+    """
+    if _analyze_sql(sql).statement not in _QUERY_STATEMENTS:
+        return None, "unknown"
+    typical = _latency_history.predict_bytes(_query_fingerprint(sql))
+    if typical is not None:
+        return int(typical), "history"
+
+    if _use_glue():
+        try:
+            estimate = await _glue_scan_estimate(database, sql)
+        except Exception as exc:
+            _log.warning("scan estimate: Glue lookup failed: %s", exc)
+            estimate = None
+        if estimate is not None:
+            return estimate, "glue"
+
+    if PREFLIGHT_EXPLAIN:
+        try:
+            estimate = await _explain_scan_estimate(database, sql)
+        except Exception as exc:
+            _log.warning("scan estimate: EXPLAIN failed: %s", exc)
+            estimate = None
+        if estimate is not None:
+            return estimate, "explain"
+
+    return None, "unknown"
+
+
+def _format_bytes(n: float) -> str:
+    if n < 1024:
+        return f"{int(n)} B"
+    for unit in ("KB", "MB", "GB"):
+        n /= 1024
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+    return f"{n:.1f} TB"
+
+
+async def _check_scan(database: str, sql: str, allow_large_scan: bool) -> Dict[str, Any]:
+    """
+    Pre-flight stage of a query: refuse it when the session budget is spent
+    or the estimate exceeds what is left of it, and reject (or warn about)
+    estimates above MAX_QUERY_SCAN_BYTES unless allow_large_scan is set.
+
+    Returns scan meta for the tool result.
+    """
+    remaining = _scan_budget.remaining()
+    if remaining == 0:
+        _metrics.inc("scan_guard_rejected_total", reason="budget")
+        raise ValueError(
+            f"Session scan budget of {_format_bytes(_scan_budget.budget_bytes)} is "
+            f"used up; no further queries can run in this session."
+        )
+    if MAX_QUERY_SCAN_BYTES <= 0 and remaining is None:
+        return {}
+
+    estimate, source = await _estimate_scan_bytes(database, sql)
+    meta: Dict[str, Any] = {
+        "scan_estimate_bytes": estimate,
+        "scan_estimate_source": source,
+    }
+    if estimate is None:
+        return meta
+
+    if remaining is not None and estimate > remaining:
+        _metrics.inc("scan_guard_rejected_total", reason="budget")
+        raise ValueError(
+            f"Query would scan about {_format_bytes(estimate)} ({source} estimate) but "
+            f"only {_format_bytes(remaining)} of the session scan budget is left. "
+            f"Add partition filters, select fewer columns or aggregate further."
+        )
+
+    if MAX_QUERY_SCAN_BYTES > 0 and estimate > MAX_QUERY_SCAN_BYTES:
+        message = (
+            f"Query would scan about {_format_bytes(estimate)} ({source} estimate), "
+            f"above the {_format_bytes(MAX_QUERY_SCAN_BYTES)} per-query limit."
+        )
+        if SCAN_LIMIT_ACTION == "reject" and not allow_large_scan:
+            _metrics.inc("scan_guard_rejected_total", reason="query_limit")
+            raise ValueError(
+                f"{message} Add partition filters (e.g. on date columns), select "
+                f"fewer columns, or re-run with allow_large_scan=True if the full "
+                f"scan is really needed."
+            )
+        _metrics.inc("scan_guard_warnings_total")
+        meta["scan_warning"] = message
+    return meta
+
+
+def _scan_priority(scan: Dict[str, Any]) -> int | None:
+    """PRIORITY_BULK for queries estimated to scan HEAVY_SCAN_BYTES or more."""
+    heavy = HEAVY_SCAN_BYTES > 0 and (scan.get("scan_estimate_bytes") or 0) >= HEAVY_SCAN_BYTES
+    return PRIORITY_BULK if heavy else None
+
+
+def _scan_meta(scan: Dict[str, Any]) -> Dict[str, Any]:
+    """Pre-flight meta plus session totals after a query ran."""
+    meta = dict(scan, session_scanned_bytes=_scan_budget.used_bytes)
+    remaining = _scan_budget.remaining()
+    if remaining is not None:
+        meta["session_budget_remaining_bytes"] = remaining
+    return meta
+
+
+# --------------------------------------------------------------------
+# Partition pruning guard
+# --------------------------------------------------------------------
+
+# String partition keys with names like these hold dates (dt='2024-01-31')
+_DATE_PARTITION_NAME = re.compile(r"^(?:dt|ds|date|day|partition_date|\w+_date|\w+_dt)$")
+_INTEGER_TYPES = ("tinyint", "smallint", "int", "integer", "bigint")
+_NUMERIC_TYPES = _INTEGER_TYPES + ("double", "real", "float", "decimal")
+_COMPARISON_BOUNDS = {">=": "lower", ">": "lower", "<=": "upper", "<": "upper", "=": "both"}
+
+
+def _top_level(tokens: List[_SqlToken], keyword: str) -> List[int]:
+    """Indexes of `keyword` outside parentheses."""
+    found, depth = [], 0
+    for i, tok in enumerate(tokens):
+        depth += (tok.text == "(") - (tok.text == ")")
+        if depth == 0 and tok.keyword == keyword:
+            found.append(i)
+    return found
+
+
+def _conjuncts(tokens: List[_SqlToken]) -> List[List[_SqlToken]]:
+    """Top-level AND terms of a WHERE clause ([] if it has a top-level OR)."""
+    if _top_level(tokens, "or"):
+        return []
+    between_ands = {
+        next((j for j in _top_level(tokens, "and") if j > i), None)
+        for i in _top_level(tokens, "between")
+    }
+    terms, lo = [], 0
+    for i in _top_level(tokens, "and"):
+        if i not in between_ands:
+            terms.append(tokens[lo:i])
+            lo = i + 1
+    terms.append(tokens[lo:])
+    return terms
+
+
+def _filtered_names(analysis: _SqlAnalysis) -> set[str]:
+    """Identifiers mentioned in any WHERE clause of the statement."""
+    names = set()
+    for block in analysis.blocks:
+        lo, hi = block.clauses.get("where", (0, 0))
+        names.update(t.name for t in analysis.tokens[lo:hi] if t.kind in ("word", "ident"))
+    return names
+
+
+def _as_timestamp(sql: str, tokens: List[_SqlToken], column_type: str) -> str | None:
+    """The value compared with a time column, as a date/timestamp expression."""
+    text = sql[tokens[0].start:tokens[-1].end]
+    if column_type.startswith(("timestamp", "date")):
+        return text
+    # Epoch columns: only when the value is visibly in seconds.
+    if (
+        column_type.startswith(_NUMERIC_TYPES)
+        and len(tokens) > 1
+        and tokens[0].keyword == "to_unixtime"
+        and tokens[1].text == "("
+    ):
+        return f"from_unixtime({text})"
+    return None
+
+
+def _time_bounds(
+    sql: str, analysis: _SqlAnalysis, ref: _TableRef, columns: List[Dict[str, Any]]
+) -> List[tuple[str, str]]:
+    """
+    (bound, timestamp expression) pairs from the WHERE conjuncts of `ref`'s
+    query block that compare one of its date / timestamp / epoch columns:
+    bound is "lower", "upper" or "both".
+    """
+    lo, hi = analysis.blocks[ref.block].clauses.get("where", (0, 0))
+    types = {c["name"].lower(): c["type"].lower() for c in columns if not c.get("partition_key")}
+    qualifiers = {ref.table, ref.alias}
+    bounds = []
+    for term in _conjuncts(list(analysis.tokens[lo:hi])):
+        i = 0
+        if len(term) > 2 and term[1].text == ".":
+            if term[0].name not in qualifiers:
+                continue
+            i = 2
+        if len(term) < i + 3 or term[i].kind not in ("word", "ident"):
+            continue
+        column_type = types.get(term[i].name)
+        op, value = term[i + 1], term[i + 2:]
+        if column_type is None:
+            continue
+        if op.keyword == "between":
+            split = _top_level(value, "and")
+            if not split or split[0] == 0 or split[0] == len(value) - 1:
+                continue
+            pairs = [("lower", value[:split[0]]), ("upper", value[split[0] + 1:])]
+        elif op.text in _COMPARISON_BOUNDS:
+            pairs = [(_COMPARISON_BOUNDS[op.text], value)]
+        else:
+            continue
+        for bound, tokens in pairs:
+            timestamp = _as_timestamp(sql, tokens, column_type)
+            if timestamp is not None:
+                bounds.append((bound, timestamp))
+    return bounds
+
+
+def _partition_value(key: Dict[str, Any], timestamp: str) -> str | None:
+    """Expression for the partition value of `timestamp`, if the key's type allows it."""
+    name, key_type = key["name"].lower(), key["type"].lower()
+    if key_type == "date":
+        return f"CAST({timestamp} AS date)"
+    if key_type.startswith(("string", "varchar")) and _DATE_PARTITION_NAME.match(name):
+        return f"date_format({timestamp}, '{PARTITION_DATE_FORMAT}')"
+    if name == "year" and key_type.startswith(_INTEGER_TYPES):
+        return f"year({timestamp})"
+    return None
+
+
+def _partition_predicates(
+    sql: str,
+    analysis: _SqlAnalysis,
+    ref: _TableRef,
+    keys: List[Dict[str, Any]],
+    columns: List[Dict[str, Any]],
+) -> List[str]:
+    """
+    Partition predicates implied by `ref`'s time filters, widened by a day
+    either side so partitions written in another time zone are never cut off.
+    """
+    bounds = _time_bounds(sql, analysis, ref, columns)
+    qualifier = (ref.alias or ref.table).replace('"', '""')
+    predicates = []
+    for key in keys:
+        column = f'"{qualifier}"."{key["name"]}"'
+        for bound, timestamp in bounds:
+            if bound in ("lower", "both"):
+                value = _partition_value(key, f"date_add('day', -1, {timestamp})")
+                if value:
+                    predicates.append(f"{column} >= {value}")
+            if bound in ("upper", "both"):
+                value = _partition_value(key, f"date_add('day', 1, {timestamp})")
+                if value:
+                    predicates.append(f"{column} <= {value}")
+    return predicates
+
+
+async def _check_partitions(
+    database: str, sql: str, allow_large_scan: bool
+) -> tuple[str, Dict[str, Any]]:
+    """
+    Find reads of partitioned tables (partition keys from the schema cache)
+    whose query never filters on a partition key. Depending on
+    PARTITION_GUARD: "warn" in meta, "derive" partition predicates from time
+    filters on the same table (warning about the rest), "reject" unless
+    allow_large_scan is set, or "off". Skipped without the Glue backend.
+
+    Returns (SQL to run, meta for the tool result).
+    """
+    if PARTITION_GUARD == "off" or not _use_glue():
+        return sql, {}
+    analysis = _analyze_sql(sql)
+    filtered = _filtered_names(analysis)
+    unpruned = []
+    for ref in analysis.tables:
+        # Best effort: no partition info (Glue denied, information_schema,
+        # unknown database) never fails the query itself.
+        try:
+            columns = await _schema_cache.columns(ref.database or database, ref.table) or []
+        except ClientError as exc:
+            _log.warning("partition guard: Glue lookup failed: %s", exc)
+            continue
+        keys = [c for c in columns if c.get("partition_key")]
+        if keys and not any(k["name"].lower() in filtered for k in keys):
+            unpruned.append((ref, keys, columns))
+    if not unpruned:
+        return sql, {}
+
+    meta: Dict[str, Any] = {}
+    if PARTITION_GUARD == "derive":
+        by_block: Dict[int, List[str]] = defaultdict(list)
+        remaining = []
+        for ref, keys, columns in unpruned:
+            predicates = _partition_predicates(sql, analysis, ref, keys, columns)
+            if predicates:
+                by_block[ref.block].extend(predicates)
+            else:
+                remaining.append((ref, keys, columns))
+        # Rewrite WHERE clauses back to front so earlier offsets stay valid.
+        for block in sorted(by_block, key=lambda b: -analysis.blocks[b].clauses["where"][0]):
+            lo, hi = analysis.blocks[block].clauses["where"]
+            start, end = analysis.tokens[lo].start, analysis.tokens[hi - 1].end
+            sql = f"{sql[:start]}({sql[start:end]}) AND {' AND '.join(by_block[block])}{sql[end:]}"
+        if by_block:
+            _metrics.inc("partition_guard_total", action="derived")
+            meta["partition_predicates_added"] = [p for ps in by_block.values() for p in ps]
+        unpruned = remaining
+        if not unpruned:
+            return sql, meta
+
+    tables = [
+        {
+            "table": f"{ref.database or database}.{ref.table}",
+            "partition_keys": [k["name"] for k in keys],
+        }
+        for ref, keys, _ in unpruned
+    ]
+    message = "No partition filter on " + "; ".join(
+        f"{t['table']} (partitioned by {', '.join(t['partition_keys'])})" for t in tables
+    ) + ": Athena will read every partition."
+    if PARTITION_GUARD == "reject" and not allow_large_scan:
+        _metrics.inc("partition_guard_total", action="rejected")
+        raise ValueError(
+            f"{message} Add a WHERE condition on the partition keys, or re-run "
+            f"with allow_large_scan=True if the full scan is really needed."
+        )
+    _metrics.inc("partition_guard_total", action="warned")
+    meta["partition_warning"] = {"message": message, "tables": tables}
+    return sql, meta
+
+
+# --------------------------------------------------------------------
+# Sampling (TABLESAMPLE)
+# --------------------------------------------------------------------
+
+_AGGREGATE_FUNCTIONS = frozenset(
+    ["count", "count_if", "sum", "avg", "min", "max", "min_by", "max_by",
+     "approx_distinct", "approx_percentile", "approx_set", "arbitrary",
+     "array_agg", "map_agg", "histogram", "listagg", "bool_and", "bool_or",
+     "every", "stddev", "stddev_pop", "stddev_samp", "variance", "var_pop",
+     "var_samp", "corr", "covar_pop", "covar_samp", "geometric_mean", "checksum"]
+)
+
+
+def _sample_fraction(ref: _TableRef) -> float:
+    """Share of a table's data a reference reads (SYSTEM sampling skips files)."""
+    if ref.sample is not None and ref.sample[0] == "system":
+        return min(max(ref.sample[1], 0.0), 100.0) / 100
+    return 1.0
+
+
+def _is_exploratory(analysis: _SqlAnalysis) -> bool:
+    """
+    A single-table "show me some rows" query: no aggregates, grouping,
+    DISTINCT, ordering, window functions or joins, so a sample still
+    answers it.
+    """
+    if analysis.statement != "select" or len(analysis.tables) != 1:
+        return False
+    if any(block.clauses.keys() & {"group", "having", "order"} for block in analysis.blocks):
+        return False
+    tokens = analysis.tokens
+    for i, tok in enumerate(tokens):
+        if tok.keyword in ("distinct", "over"):
+            return False
+        if tok.keyword in _AGGREGATE_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1].text == "(":
+            return False
+    return True
+
+
+async def _apply_sampling(
+    database: str, sql: str, sample_pct: float | None
+) -> tuple[str, Dict[str, Any]]:
+    """
+    Read the largest table of a query through TABLESAMPLE: at `sample_pct`
+    percent if given, otherwise at AUTO_SAMPLE_PCT for exploratory queries
+    on tables of at least AUTO_SAMPLE_MIN_BYTES. Other tables stay whole so
+    joins still match. sample_pct=100 means exact (never sampled).
+
+    Returns (SQL to run, {"sampled": {...}} or {}).
+    """
+    if sample_pct is not None and not 0 < sample_pct <= 100:
+        raise ValueError("sample_pct must be greater than 0 and at most 100")
+    if sample_pct == 100:
+        return sql, {}
+    analysis = _analyze_sql(sql)
+    automatic = sample_pct is None
+    if automatic and (AUTO_SAMPLE_PCT <= 0 or not _is_exploratory(analysis)):
+        return sql, {}
+    refs = [ref for ref in analysis.tables if ref.sample is None]
+    if analysis.statement not in _QUERY_STATEMENTS or not refs:
+        return sql, {}
+
+    sizes = []
+    for ref in refs:
+        stats = None
+        if _use_glue():
+            try:
+                stats = await _schema_cache.table_stats(ref.database or database, ref.table)
+            except ClientError as exc:
+                _log.warning("sampling: Glue lookup failed: %s", exc)
+        sizes.append((stats or {}).get("size_bytes") or 0)  # 0: size unknown
+    size, target = max(zip(sizes, refs), key=lambda pair: pair[0])
+    if automatic and size < AUTO_SAMPLE_MIN_BYTES:
+        return sql, {}
+
+    percent = AUTO_SAMPLE_PCT if automatic else sample_pct
+    method = SAMPLE_METHOD.upper()
+    sql = f"{sql[:target.end]} TABLESAMPLE {method} ({percent:g}){sql[target.end:]}"
+    _metrics.inc("sampled_queries_total", mode="auto" if automatic else "requested")
+    table = f"{target.database or database}.{target.table}"
+    return sql, {
+        "sampled": {
+            "method": method,
+            "percent": percent,
+            "table": table,
+            "automatic": automatic,
+            "note": (
+                f"Rows come from a ~{percent:g}% sample of {table}: counts, totals "
+                f"and the absence of matches are not exact. Re-run with "
+                f"sample_pct=100 for exact results."
+            ),
+        }
+    }
+
+
+# --------------------------------------------------------------------
+# Query jobs (start_query / query_status / fetch_results)
+# --------------------------------------------------------------------
+
+
+class _QueryJob:
+    """A query started by start_query, executed by a background task."""
+
+    def __init__(self, database: str, sql: str):
+        self.job_id = str(uuid.uuid4())
+        self.database = database
+        self.sql = sql
+        self.state = "QUEUED"  # -> RUNNING -> SUCCEEDED | FAILED | CANCELLED
+        self.query_id: str | None = None
+        self.wait_stats: Dict[str, Any] | None = None
+        self.scan: Dict[str, Any] = {}
+        self.error: str | None = None
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def _mark_started(self, query_id: str) -> None:
+        self.query_id = query_id
+        self.state = "RUNNING"
+        self.started = time.time()
+
+    async def run(self, reuse_max_age_min: int, allow_large_scan: bool) -> None:
+        try:
+            self.scan = await _check_scan(self.database, self.sql, allow_large_scan)
+            self.query_id, self.wait_stats = await _execute_query(
+                self.database,
+                self.sql,
+                reuse_max_age_min,
+                _scan_priority(self.scan),
+                on_start=self._mark_started,
+            )
+            self.state = "SUCCEEDED"
+        except asyncio.CancelledError:
+            self.state = "CANCELLED"
+            raise
+        except Exception as exc:
+            self.state = "FAILED"
+            self.error = str(exc)
+        finally:
+            self.finished = time.time()
+            _metrics.inc("query_jobs_finished_total", state=self.state.lower())
+
+    def status(self) -> Dict[str, Any]:
+        now = self.finished or time.time()
+        status: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "state": self.state,
+            "query_execution_id": self.query_id,
+            "elapsed_ms": int((now - self.created) * 1000),
+        }
+        if self.state == "RUNNING":
+            # Progress is estimated from how long this query shape usually
+            # takes; Athena reports no progress of its own.
+            typical = _latency_history.predict(_query_fingerprint(self.sql))
+            if typical:
+                status["expected_ms"] = int(typical * 1000)
+                status["progress"] = round(min((now - self.started) / typical, 0.95), 2)
+        elif self.state == "SUCCEEDED":
+            status["progress"] = 1.0
+            status["meta"] = {
+                "data_scanned_bytes": self.wait_stats["data_scanned_bytes"],
+                "reused_result": self.wait_stats["reused_result"],
+                "queued_ms": self.wait_stats["queued_ms"],
+                "engine_ms": self.wait_stats["engine_ms"],
+                "scheduler_wait_ms": self.wait_stats["scheduler_wait_ms"],
+                **_scan_meta(self.scan),
+            }
+        elif self.error:
+            status["error"] = self.error
+        return status
+
+
+class _JobStore:
+    """
+    Jobs by id. Finished jobs expire after JOB_TTL_SEC and the oldest
+    finished ones are evicted beyond MAX_JOBS; running jobs stay.
+    """
+
+    def __init__(self, max_jobs: int, ttl_sec: float):
+        self.max_jobs = max_jobs
+        self.ttl_sec = ttl_sec
+        self._jobs: "OrderedDict[str, _QueryJob]" = OrderedDict()
+
+    def _evict(self) -> None:
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.done]
+        excess = len(self._jobs) - self.max_jobs + 1
+        for job in finished:
+            if now - job.finished > self.ttl_sec or excess > 0:
+                del self._jobs[job.job_id]
+                excess -= 1
+
+    def add(self, job: _QueryJob) -> None:
+        self._evict()
+        if len(self._jobs) >= self.max_jobs:
+            raise ValueError(
+                f"{len(self._jobs)} query jobs are still running; wait for some "
+                f"to finish (query_status) before starting more."
+            )
+        self._jobs[job.job_id] = job
+        _metrics.set("query_jobs", len(self._jobs))
+
+    def get(self, job_id: str) -> _QueryJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown or expired job_id: {job_id}")
+        return job
+
+
+_jobs = _JobStore(MAX_JOBS, JOB_TTL_SEC)
+
+
+# --------------------------------------------------------------------
+# MCP Tools
+# --------------------------------------------------------------------
+
+@mcp.tool()
+@_instrumented
+async def list_tables(
+    database: str | None = None,
+    reuse_max_age_minutes: int | None = None,
+) -> List[str]:
+    """
+    List Athena tables for a given database.
+
+    Served from the cached Glue Data Catalog (MTB_ATHENA_METADATA_BACKEND=glue,
+    the default) or a SHOW TABLES query (=athena, or if Glue is denied).
+
+    Args:
+        database: Athena database name. If omitted, uses MTB_ATHENA_DEFAULT_DB.
+        reuse_max_age_minutes: Athena backend only: accept results of an
+                               identical query up to this age (0 = always
+                               re-run; default MTB_ATHENA_REUSE_LIST_TABLES_MIN)
+    """
+    db = database or DEFAULT_DATABASE
+    if not db:
+        raise ValueError(
+            "No database provided and MTB_ATHENA_DEFAULT_DB is not set."
+        )
+
+    if _use_glue():
+        try:
+            return sorted(await _schema_cache.tables(db))
+        except ClientError as exc:
+            if not _glue_access_denied(exc):
+                raise
+            _log.warning("Glue access denied, falling back to Athena: %s", exc)
+
+    return await _athena_list_tables(db, reuse_max_age_minutes)
+
+
+@mcp.tool()
+@_instrumented
+async def describe_table(
+    database: str,
+    table: str,
+    reuse_max_age_minutes: int | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Describe columns for a table: name, type, comment, partition_key.
+
+    Partition keys are listed after the regular columns with
+    partition_key=True; filter on them to limit the data Athena scans.
+
+    Args:
+        database: Athena database name
+        table:    table name
+        reuse_max_age_minutes: Athena backend only: accept results of an
+                               identical query up to this age (0 = always
+                               re-run; default MTB_ATHENA_REUSE_DESCRIBE_TABLE_MIN)
+    """
+    if _use_glue():
+        try:
+            columns = await _schema_cache.columns(database, table)
+        except ClientError as exc:
+            if not _glue_access_denied(exc):
+                raise
+            _log.warning("Glue access denied, falling back to Athena: %s", exc)
+        else:
+            if columns is None:
+                raise ValueError(f"Table {database}.{table} not found in the Glue catalog")
+            return [dict(c) for c in columns]
+
+    return await _athena_describe_table(database, table, reuse_max_age_minutes)
+
+
+def _compact_columns(columns: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """{"columns": ["name type -- comment", ...], "partition_keys": [...]}"""
+    def entry(col: Dict[str, Any]) -> str:
+        text = f"{col['name']} {col['type']}".strip()
+        return f"{text} -- {col['comment']}" if col.get("comment") else text
+
+    return {
+        "columns": [entry(c) for c in columns if not c.get("partition_key")],
+        "partition_keys": [entry(c) for c in columns if c.get("partition_key")],
+    }
+
+
+@mcp.tool()
+@_instrumented
+async def describe_tables(database: str, tables: List[str]) -> Dict[str, Any]:
+    """
+    Describe several tables in one call (use this instead of calling
+    describe_table once per candidate table, e.g. before writing a JOIN).
+
+    Returns {"database", "tables": {table: {"columns": ["name type", ...],
+    "partition_keys": [...]}}, "missing": [tables not found]}, plus
+    "errors": {table: message} for tables that could not be described for
+    another reason (throttling, timeouts, ...); retry those. Column comments
+    are appended as "-- comment".
+
+    Args:
+        database: Athena database name
+        tables:   table names
+    """
+    _log.debug("describe_tables: %d table(s) (db=%s)", len(tables), database)
+
+    names = list(dict.fromkeys(tables))  # de-duplicate, keep order
+    described: Dict[str, Any] = {}
+    missing: List[str] = []
+    errors: Dict[str, str] = {}
+
+    glue_tables: Dict[str, List[Dict[str, Any]]] | None = None
+    if _use_glue():
+        try:
+            # One cached catalog sweep serves every requested table.
+            glue_tables = await _schema_cache.tables(database)
+        except ClientError as exc:
+            if not _glue_access_denied(exc):
+                raise
+            _log.warning("Glue access denied, falling back to Athena: %s", exc)
+
+    if glue_tables is not None:
+        for name in names:
+            columns = glue_tables.get(name.strip('"`').lower())
+            if columns is None:
+                columns = await _schema_cache.columns(database, name)
+            if columns is None:
+                missing.append(name)
+            else:
+                described[name] = _compact_columns(columns)
+    else:
+        results = await asyncio.gather(
+            *(_athena_describe_table(database, name, None) for name in names),
+            return_exceptions=True,
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if _table_not_found(result):
+                missing.append(name)
+            elif isinstance(result, BaseException):
+                errors[name] = str(result)
+            else:
+                described[name] = _compact_columns(result)
+
+    response = {"database": database, "tables": described, "missing": missing}
+    if errors:
+        response["errors"] = errors
+    return response
+
+
+@mcp.tool()
+@_instrumented
+async def search_schema(
+    pattern: str,
+    database: str | None = None,
+    max_results: int = 50,
+) -> Dict[str, Any]:
+    """
+    Find tables and columns whose name, type or comment matches `pattern`
+    across the whole catalog (e.g. "salary", "account id", "merchant").
+
+    Every word of the pattern must match (as a word, a substring, or a
+    close misspelling of a name). Use this instead of listing and
+    describing many tables to find where a concept lives.
+
+    Args:
+        pattern:     words to look for (case-insensitive)
+        database:    restrict the search to one database (default: all)
+        max_results: maximum number of matches to return (default 50)
+
+    Returns {"matches": [{"database", "table", "column"?, "type"?,
+    "comment"?, "partition_key"?, "score"}], "total_matches", "databases",
+    "search_ms"}.
+    Matches without "column" are table-name matches.
+    """
+    if not _use_glue():
+        raise ValueError("search_schema requires the Glue metadata backend (MTB_ATHENA_METADATA_BACKEND=glue)")
+
+    if database:
+        databases = [database]
+    else:
+        try:
+            databases = await _schema_cache.databases()
+        except ClientError as exc:
+            if not _glue_access_denied(exc):
+                raise
+            _log.warning("cannot list Glue databases, searching %s: %s", DEFAULT_DATABASE, exc)
+            databases = [DEFAULT_DATABASE]
+
+    # Make sure every database is indexed; cached ones return immediately.
+    results = await _schema_cache.sweep(databases)
+    searched = []
+    for db, result in zip(databases, results):
+        if isinstance(result, BaseException):
+            _log.warning("search_schema: skipping %s: %s", db, result)
+        else:
+            searched.append(db)
+
+    started = time.monotonic()
+    matches, total = _schema_index.search(pattern, set(searched), max(1, max_results))
+    search_ms = round((time.monotonic() - started) * 1000, 1)
+    _metrics.observe("schema_search_ms", search_ms)
+    _log.debug("search_schema: %r -> %d match(es) in %.1f ms", pattern, total, search_ms)
+    return {
+        "matches": matches,
+        "total_matches": total,
+        "databases": searched,
+        "search_ms": search_ms,
+    }
+
+
+async def _collect_result(
+    query_id: str,
+    wait_stats: Dict[str, Any],
+    max_rows: int,
+    typed: bool,
+    columnar: bool,
+) -> tuple[
+    List[Dict[str, Any]] | Dict[str, List[Any]], Dict[str, Any], Dict[str, Any] | None
+]:
+    """
+    Fetch (S3 fast path or GetQueryResults) and shape a finished query's
+    rows. Also returns the cursor state to resume from if rows were left
+    over (None if the result was read completely).
+    """
+    fetch_started = time.monotonic()
+    result_source = "api"
+    continuation: Dict[str, Any] | None = None
+    if _use_s3_fastpath(wait_stats, max_rows):
+        try:
+            # One extra row tells whether the result goes on.
+            rows, column_info = await _run_blocking(
+                _fetch_rows_s3, query_id, wait_stats["output_location"], max_rows + 1
+            )
+            result_source = "s3"
+            if len(rows) > max_rows:
+                rows = rows[:max_rows]
+                continuation = {"output_location": wait_stats["output_location"]}
+        except ClientError as exc:
+            _log.warning("S3 result read failed, using GetQueryResults: %s", exc)
+    if result_source == "api":
+        rows, column_info, token = await _run_blocking(
+            _fetch_page, query_id, max_rows, header=_result_has_header(wait_stats)
+        )
+        if token:
+            continuation = {"next_token": token}
+    if continuation is not None:
+        continuation.update(
+            query_id=query_id,
+            source=result_source,
+            offset=len(rows),
+            column_info=column_info,
+            typed=typed,
+            columnar=columnar,
+        )
+    decode_started = time.monotonic()
+    result = await _run_blocking(_shape_result, rows, column_info, typed, columnar)
+    fetch_ms = int((decode_started - fetch_started) * 1000)
+    decode_ms = int((time.monotonic() - decode_started) * 1000)
+    _metrics.observe("result_fetch_ms", fetch_ms, source=result_source)
+    _metrics.observe("result_decode_ms", decode_ms)
+    _metrics.observe("result_rows", len(rows))
+    return result, {
+        "rows_returned": len(rows),
+        "fetch_ms": fetch_ms,
+        "decode_ms": decode_ms,
+        "result_source": result_source,
+    }, continuation
+
+
+def _cache_lookup(cache_key: tuple | None, shape: str) -> Dict[str, Any] | None:
+    """A cached tool response (with a fresh cursor if rows were left over), or None."""
+    if cache_key is None:
+        return None
+    cached = _result_cache.get(cache_key)
+    if cached is None:
+        return None
+    meta = {"cache_hit": True, "rows_returned": _row_count(cached["result"])}
+    meta.update(_cursor_meta(cached["continuation"]))
+    meta.update(cached.get("labels", {}))
+    return {shape: cached["result"], "meta": meta}
+
+
+def _cursor_meta(continuation: Dict[str, Any] | None) -> Dict[str, Any]:
+    """{"has_more", "cursor"} for a tool result; opens a cursor if rows were left over."""
+    if continuation is None:
+        return {"has_more": False}
+    if continuation["offset"] >= continuation.get("row_limit", math.inf):
+        # The extra row only proves there is more; the executed query ends there.
+        return {"has_more": True, "cursor": None}
+    return {"has_more": True, "cursor": _cursors.open(continuation)}
+
+
+def _pushdown_rows(max_rows: int) -> int:
+    """Rows a pushed-down query can deliver (max_rows plus what fetch_more may page)."""
+    return max(max_rows, LIMIT_PUSHDOWN_ROWS)
+
+
+def _limited_sql(sql: str, max_rows: int, limit_pushdown: bool) -> str | None:
+    """
+    The query to submit with LIMIT _pushdown_rows(max_rows) + 1 pushed
+    down, or None to run `sql` as is.
+    """
+    if not (limit_pushdown and LIMIT_PUSHDOWN):
+        return None
+    return _push_down_limit(sql, _pushdown_rows(max_rows) + 1)
+
+
+def _timing_meta(wait_stats: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "data_scanned_bytes": wait_stats["data_scanned_bytes"],
+        "queued_ms": wait_stats["queued_ms"],
+        "planning_ms": wait_stats["planning_ms"],
+        "engine_ms": wait_stats["engine_ms"],
+        "service_ms": wait_stats["service_ms"],
+        "wait_ms": wait_stats["wait_ms"],
+        "scheduler_wait_ms": wait_stats["scheduler_wait_ms"],
+    }
+
+
+async def _readonly_query(
+    tool: str,
+    database: str,
+    sql: str,
+    *,
+    max_rows: int,
+    use_cache: bool,
+    reuse_max_age: int,
+    typed: bool,
+    columnar: bool,
+    allow_large_scan: bool,
+    limit_pushdown: bool,
+    sample_pct: float | None,
+    poller: _BatchPoller | None = None,
+) -> Dict[str, Any]:
+    """
+    The run_readonly_query pipeline, shared with run_readonly_queries:
+    read-only check, LIMIT pushdown, result cache, partition guard,
+    sampling, scan guard, run, fetch. Returns {"rows" | "columns", "meta"}.
+    """
+    is_safe, error = is_safe_readonly_query(sql)
+    if not is_safe:
+        raise ValueError(error)
+
+    shape = "columns" if columnar else "rows"
+    limited_sql = _limited_sql(sql, max_rows, limit_pushdown)
+    cache_key = _result_cache_key(
+        database, sql, max_rows, typed, shape, limited_sql is not None, sample_pct
+    )
+    if use_cache:
+        cached = _cache_lookup(cache_key, shape)
+        if cached is not None:
+            _log.debug("%s cache hit on %s", tool, database)
+            return cached
+
+    executed_sql, partitions = await _check_partitions(
+        database, limited_sql or sql, allow_large_scan
+    )
+    executed_sql, sampling = await _apply_sampling(database, executed_sql, sample_pct)
+    _log.debug("%s on %s (max_rows=%d):\n%s", tool, database, max_rows, executed_sql)
+
+    scan = await _check_scan(database, executed_sql, allow_large_scan)
+    qid, wait_stats, coalesced = await _run_query(
+        database, executed_sql, reuse_max_age, _scan_priority(scan), poller
+    )
+
+    result, result_meta, continuation = await _collect_result(
+        qid, wait_stats, max_rows, typed, columnar
+    )
+    if continuation is not None and limited_sql is not None:
+        continuation["row_limit"] = _pushdown_rows(max_rows)
+    if cache_key is not None:
+        _result_cache.put(
+            cache_key, {"result": result, "continuation": continuation, "labels": sampling}
+        )
+
+    meta = {
+        "query_execution_id": qid,
+        "cache_hit": False,
+        "coalesced": coalesced,
+        "reused_result": wait_stats["reused_result"],
+        "reuse_max_age_minutes": reuse_max_age,
+        **_timing_meta(wait_stats),
+        **result_meta,
+        **_cursor_meta(continuation),
+        **_scan_meta(scan),
+        **partitions,
+        **sampling,
+    }
+    if executed_sql != sql:
+        meta["rewritten_sql"] = executed_sql
+    return {shape: result, "meta": meta}
+
+
+@mcp.tool()
+@_instrumented
+async def run_readonly_query(
+    database: str,
+    sql: str,
+    max_rows: int = 50,
+    use_cache: bool = True,
+    reuse_max_age_minutes: int | None = None,
+    typed: bool = True,
+    columnar: bool = False,
+    allow_large_scan: bool = False,
+    limit_pushdown: bool = True,
+    sample_pct: float | None = None,
+) -> Dict[str, Any]:
+    """
+    Run a SELECT-only Athena query.
+
+    Returns {"rows": list-of-dicts, "meta": {...}}, or with columnar=True
+    {"columns": {name: [values...]}, "meta": {...}}. meta reports the
+    QueryExecutionId, bytes scanned (and the pre-flight estimate, session
+    total and remaining session budget), timings and whether the result
+    came from the server cache or from Athena result reuse. If the result
+    had more than max_rows rows, meta has "has_more": true and a "cursor"
+    for fetch_more (the query is not re-run).
+
+    Queries are submitted with their outer LIMIT lowered (or added) to
+    max(max_rows, MTB_ATHENA_LIMIT_PUSHDOWN_ROWS) + 1 so Athena stops
+    early; meta["rewritten_sql"] shows the statement that ran. fetch_more
+    pages up to that many rows; past it "has_more" stays true with a null
+    cursor, and limit_pushdown=False re-runs the query without the cap.
+
+    Queries estimated to scan more than MTB_ATHENA_MAX_QUERY_SCAN_GB are
+    rejected before they run; narrow them (partition filters, fewer
+    columns) rather than setting allow_large_scan.
+
+    Queries on partitioned tables that never filter on a partition key get
+    meta["partition_warning"] naming the keys to filter on (depending on
+    MTB_ATHENA_PARTITION_GUARD they are instead rejected, or partition
+    predicates implied by their time filters are added and listed in
+    meta["partition_predicates_added"]).
+
+    Sampled results (sample_pct, or automatically for exploratory queries
+    when MTB_ATHENA_AUTO_SAMPLE_PCT is set) carry meta["sampled"]; say so
+    when presenting them.
+
+    Args:
+        database:  Athena database name
+        sql:       SQL query (must be read-only)
+        max_rows:  max number of rows to return (default 50)
+        use_cache: reuse a recent identical result from the server cache
+                   (default True); pass False when fresh data is required
+        reuse_max_age_minutes: accept Athena results of an identical query
+                   up to this age (0 = always re-run; default
+                   MTB_ATHENA_REUSE_QUERY_MIN)
+        typed:     decode values into numbers, booleans, dates and
+                   timestamps using the result's column types (default
+                   True); False returns every value as a string
+        columnar:  return one list per column instead of row dicts
+        allow_large_scan: run even if the estimate exceeds the per-query
+                   scan limit (the session budget still applies)
+        limit_pushdown: submit the query with the LIMIT above (default
+                   True)
+        sample_pct: read the query's largest table through a TABLESAMPLE of
+                   this percent (e.g. 5) for "show me some ..." questions
+                   that need no exact answer; 100 = never sample
+    """
+    return await _readonly_query(
+        "run_readonly_query",
+        database,
+        sql,
+        max_rows=max_rows,
+        use_cache=use_cache,
+        reuse_max_age=_reuse_max_age("run_readonly_query", reuse_max_age_minutes),
+        typed=typed,
+        columnar=columnar,
+        allow_large_scan=allow_large_scan,
+        limit_pushdown=limit_pushdown,
+        sample_pct=sample_pct,
+    )
+
+
+@mcp.tool()
+@_instrumented
+async def fetch_more(cursor: str, n: int = 50) -> Dict[str, Any]:
+    """
+    Continue a run_readonly_query / run_readonly_queries result that was
+    cut off at max_rows, without re-running the query.
+
+    Returns the next `n` rows in the original shape ("rows" or "columns")
+    and "meta" with "offset" (index of the first row returned), "has_more"
+    and the "cursor" to pass again (null once the result is exhausted, or
+    with "has_more" still true once the pushed-down LIMIT is reached).
+
+    Args:
+        cursor: meta["cursor"] of the previous result
+        n:      rows to return (default 50)
+    """
+    state = _cursors.get(cursor)
+    if state is None:
+        raise ValueError(
+            "Unknown or expired cursor; re-run the query (with a larger "
+            "max_rows if more rows are needed)."
+        )
+    row_limit = state.get("row_limit", math.inf)
+
+    async with state["busy"]:
+        offset = state["offset"]
+        # Never hand out the row past a pushed-down LIMIT: it only marks "more".
+        n = max(1, min(n, row_limit - offset))
+        fetch_started = time.monotonic()
+        if state["source"] == "s3":
+            rows, _ = await _run_blocking(
+                _fetch_rows_s3, state["query_id"], state["output_location"], n + 1, offset
+            )
+            has_more = len(rows) > n
+            rows = rows[:n]
+        else:
+            rows, _, token = await _run_blocking(
+                _fetch_page, state["query_id"], n, state["next_token"]
+            )
+            state["next_token"] = token
+            has_more = token is not None
+        state["offset"] = offset + len(rows)
+        fetch_ms = int((time.monotonic() - fetch_started) * 1000)
+
+    at_limit = state["offset"] >= row_limit
+    if not has_more or at_limit:
+        _cursors.close(cursor)
+    result = await _run_blocking(
+        _shape_result, rows, state["column_info"], state["typed"], state["columnar"]
+    )
+    _metrics.inc("cursor_fetches_total", source=state["source"])
+    return {
+        "columns" if state["columnar"] else "rows": result,
+        "meta": {
+            "query_execution_id": state["query_id"],
+            "offset": offset,
+            "rows_returned": len(rows),
+            "has_more": has_more,
+            "cursor": cursor if has_more and not at_limit else None,
+            "fetch_ms": fetch_ms,
+        },
+    }
+
+
+# Upper bound on statements per run_readonly_queries call
+MAX_BATCH_QUERIES = 20
+
+
+@mcp.tool()
+@_instrumented
+async def run_readonly_queries(
+    database: str,
+    queries: List[str],
+    max_rows: int = 50,
+    use_cache: bool = True,
+    typed: bool = True,
+    columnar: bool = False,
+    limit_pushdown: bool = True,
+    sample_pct: float | None = None,
+) -> Dict[str, Any]:
+    """
+    Run several independent SELECT-only queries concurrently (e.g. "this
+    month vs. last month", "top institutions and top merchants") and return
+    all results together; total latency is that of the slowest query, not
+    the sum.
+
+    Returns {"results": [{"sql", "rows" (or "columns"), "meta"} or
+    {"sql", "error"}, ...] in input order, "meta": {"wall_ms", ...}}. A
+    failing or rejected query only fails its own entry.
+
+    Args:
+        database: Athena database name
+        queries:  SQL statements (each must be read-only; at most 20)
+        max_rows / use_cache / typed / columnar / limit_pushdown /
+        sample_pct: as for run_readonly_query, applied to every query
+    """
+    if not queries:
+        raise ValueError("queries must contain at least one SQL statement")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"At most {MAX_BATCH_QUERIES} queries per call")
+
+    _log.debug("run_readonly_queries: %d queries on %s", len(queries), database)
+    started = time.monotonic()
+    reuse_max_age = _reuse_max_age("run_readonly_query")
+    poller = _BatchPoller()
+
+    async def run_one(sql: str) -> Dict[str, Any]:
+        return await _readonly_query(
+            "run_readonly_queries",
+            database,
+            sql,
+            max_rows=max_rows,
+            use_cache=use_cache,
+            reuse_max_age=reuse_max_age,
+            typed=typed,
+            columnar=columnar,
+            allow_large_scan=False,
+            limit_pushdown=limit_pushdown,
+            sample_pct=sample_pct,
+            poller=poller,
+        )
+
+    outcomes = await asyncio.gather(*(run_one(sql) for sql in queries), return_exceptions=True)
+    results = []
+    for sql, outcome in zip(queries, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+        if isinstance(outcome, BaseException):
+            results.append({"sql": sql, "error": str(outcome)})
+        else:
+            results.append({"sql": sql, **outcome})
+
+    return {
+        "results": results,
+        "meta": {
+            "queries": len(queries),
+            "failed": sum(1 for r in results if "error" in r),
+            "wall_ms": int((time.monotonic() - started) * 1000),
+        },
+    }
+
+
+@mcp.tool()
+@_instrumented
+async def start_query(
+    database: str,
+    sql: str,
+    reuse_max_age_minutes: int | None = None,
+    allow_large_scan: bool = False,
+) -> Dict[str, Any]:
+    """
+    Start a SELECT-only Athena query in the background and return a job
+    handle immediately: {"job_id", "state", ...}.
+
+    Use this to run several independent or long queries at once: start them
+    all, then poll each with query_status and read rows with fetch_results.
+    Arguments are as for run_readonly_query.
+    """
+    is_safe, error = is_safe_readonly_query(sql)
+    if not is_safe:
+        raise ValueError(error)
+
+    executed_sql, partitions = await _check_partitions(database, sql, allow_large_scan)
+    job = _QueryJob(database, executed_sql)
+    _jobs.add(job)
+    _log.debug("start_query %s on %s:\n%s", job.job_id, database, executed_sql)
+    reuse_max_age = _reuse_max_age("run_readonly_query", reuse_max_age_minutes)
+    job.task = asyncio.create_task(job.run(reuse_max_age, allow_large_scan))
+    status = {**job.status(), **partitions}
+    if executed_sql != sql:
+        status["rewritten_sql"] = executed_sql
+    return status
+
+
+@mcp.tool()
+@_instrumented
+async def query_status(job_id: str, wait_sec: float = 0) -> Dict[str, Any]:
+    """
+    State of a start_query job: QUEUED, RUNNING (with an estimated
+    "progress" 0-1 when this query shape has run before), SUCCEEDED (with
+    "meta": bytes scanned, timings) or FAILED / CANCELLED (with "error").
+
+    Args:
+        job_id:   handle returned by start_query
+        wait_sec: wait up to this many seconds (max 60) for the job to
+                  finish before answering (default 0: answer immediately)
+    """
+    job = _jobs.get(job_id)
+    if wait_sec > 0 and not job.done and job.task is not None:
+        await asyncio.wait({job.task}, timeout=min(wait_sec, 60))
+    return job.status()
+
+
+@mcp.tool()
+@_instrumented
+async def fetch_results(
+    job_id: str,
+    max_rows: int = 50,
+    next_token: str | None = None,
+    typed: bool = True,
+    columnar: bool = False,
+) -> Dict[str, Any]:
+    """
+    Read a page of rows of a SUCCEEDED start_query job.
+
+    Returns {"rows": [...] (or "columns" with columnar=True), "next_token",
+    "meta"}; pass next_token back to read the following page (it is null
+    once all rows were read). The query is not re-run.
+
+    Args:
+        job_id:     handle returned by start_query
+        max_rows:   rows in this page (default 50)
+        next_token: continue after the previous page
+        typed / columnar: as for run_readonly_query
+    """
+    job = _jobs.get(job_id)
+    if job.state != "SUCCEEDED":
+        raise ValueError(
+            f"Job {job_id} is {job.state}"
+            + (f": {job.error}" if job.error else "; check query_status first")
+        )
+
+    fetch_started = time.monotonic()
+    rows, column_info, token = await _run_blocking(
+        _fetch_page,
+        job.query_id,
+        max(1, max_rows),
+        next_token,
+        header=_result_has_header(job.wait_stats),
+    )
+    fetch_ms = int((time.monotonic() - fetch_started) * 1000)
+    result = await _run_blocking(_shape_result, rows, column_info, typed, columnar)
+    shape = "columns" if columnar else "rows"
+    return {
+        shape: result,
+        "next_token": token,
+        "meta": {
+            "query_execution_id": job.query_id,
+            "rows_returned": len(rows),
+            "fetch_ms": fetch_ms,
+        },
+    }
+
+
+@mcp.tool()
+@_instrumented
+async def export_query_parquet(
+    database: str,
+    sql: str,
+    preview_rows: int = 20,
+    columns: List[str] | None = None,
+) -> Dict[str, Any]:
+    """
+    Export a large SELECT result as Parquet and summarize it.
+
+    The query runs as UNLOAD ... WITH (format='PARQUET') into a fresh
+    prefix under MTB_ATHENA_UNLOAD_LOCATION; the files are then read back
+    with pyarrow. Returns the S3 location and files, total rows and bytes,
+    the schema and a columnar preview ({column: [values...]}).
+
+    Args:
+        database:     Athena database name
+        sql:          SELECT query (must be read-only)
+        preview_rows: rows to include in the preview (default 20)
+        columns:      only read these columns for the preview
+
+    Large scans are expected here, so only the session scan budget applies.
+    """
+    if pq is None:
+        raise RuntimeError(
+            "export_query_parquet needs pyarrow (pip install pyarrow)"
+        )
+
+    is_safe, error = is_safe_readonly_query(sql)
+    if not is_safe:
+        raise ValueError(error)
+    if _analyze_sql(sql).statement != "select":
+        raise ValueError("Only SELECT queries can be exported")
+
+    scan = await _check_scan(database, sql, allow_large_scan=True)
+
+    location = f"{UNLOAD_LOCATION.rstrip('/')}/{uuid.uuid4()}/"
+    statement = _unload_statement(sql, location)
+    _log.debug("export_query_parquet on %s:\n%s", database, statement)
+
+    qid, wait_stats = await _execute_query(database, statement, priority=PRIORITY_BULK)
+
+    result = await _run_blocking(_read_parquet_export, location, preview_rows, columns)
+    result["meta"] = {
+        "query_execution_id": qid,
+        **_timing_meta(wait_stats),
+        **_scan_meta(scan),
+    }
+    return result
+
+
+@mcp.tool()
+@_instrumented
+async def get_server_metrics() -> Dict[str, float]:
+    """
+    Return server counters (queries started, queries cancelled and the
+    bytes they scanned / are estimated to have saved, result cache
+    hits/misses/size, Athena result reuse and its estimated savings,
+    coalesced identical concurrent queries / schema fetches, bytes scanned
+    this session, scan-guard rejections, scheduler queue depth / running
+    queries / wait time, throttled Athena calls) and per-tool latency summaries
+    (p50/p95/p99 of tool calls and of Athena queue/planning/engine time).
+    """
+    return _metrics.snapshot()
 
-    return [dict(zip(columns, row)) for row in rows]  
 
 # --------------------------------------------------------------------
 # Main entrypoint for MCP (STDIO transport)
 # --------------------------------------------------------------------
 
 if __name__ == "__main__":
-    print("[mtb_athena] Starting MCP server on stdio…")
+    # Clients (Streamlit reruns, REPL exit) terminate the server process;
+    # turn SIGTERM into a normal exit so in-flight queries get stopped.
+    atexit.register(_stop_inflight_queries)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _start_metrics_exporters()
+    # Load the schema snapshot while the client is still connecting.
+    _io_executor.submit(_schema_cache._ensure_loaded)
+
+    _log.info("Starting MCP server on stdio…")
     mcp.run(transport="stdio")
     
\ No newline at end of file
@@ -0,0 +1,217 @@
+# scenario3_custom_server/test_mtb_athena_server.py
+"""
+Tests for mtb_athena_server against the in-process Athena stub of
+mtb_athena_bench (no AWS account needed):
+
+    python -m unittest discover -s scenario3_custom_server
+"""
+
+import asyncio
+import os
+import re
+import sys
+import time
+import unittest
+
+os.environ["MTB_ATHENA_SCHEMA_SNAPSHOT"] = ""
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mtb_athena_bench import FakeAthena, _import_server, start_stub  # noqa: E402
+
+_httpd = start_stub(FakeAthena())
+server = _import_server(f"http://127.0.0.1:{_httpd.server_address[1]}")
+server.PREFLIGHT_EXPLAIN = False
+
+
+def tearDownModule():
+    _httpd.shutdown()
+
+
+class LimitedAthena(FakeAthena):
+    """FakeAthena that honours a trailing LIMIT, like Athena would."""
+
+    def _limit(self, query_id: str) -> int | None:
+        match = re.search(r"LIMIT (\d+)\s*$", self.queries.get(query_id, {}).get("sql", ""))
+        return int(match.group(1)) if match else None
+
+    def GetQueryResults(self, body):
+        limit, rows = self._limit(body["QueryExecutionId"]), self.rows
+        if limit is not None:
+            self.rows = rows[:limit + 1]
+        try:
+            return super().GetQueryResults(body)
+        finally:
+            self.rows = rows
+
+    def get_object(self, path: str) -> bytes | None:
+        data = super().get_object(path)
+        self._csv = None
+        limit = self._limit(path.partition("/")[2][:-len(".csv")])
+        if data is None or limit is None:
+            return data
+        return b"".join(data.splitlines(keepends=True)[:limit + 1])
+
+
+class HeaderlessAthena(FakeAthena):
+    """SHOW / DESCRIBE style results: no header row in GetQueryResults."""
+
+    def GetQueryResults(self, body):
+        result = super().GetQueryResults(
+            dict(body, NextToken=str(int(body.get("NextToken", "0")) + 1))
+        )
+        next_token = result.pop("NextToken", None)
+        if next_token is not None:
+            result["NextToken"] = str(int(next_token) - 1)
+        return result
+
+    def _execution(self, qid):
+        return dict(super()._execution(qid), StatementType="UTILITY")
+
+
+class StubTestCase(unittest.IsolatedAsyncioTestCase):
+    def use_backend(self, backend: FakeAthena) -> FakeAthena:
+        _httpd.backend = backend
+        return backend
+
+    def patch(self, name: str, value) -> None:
+        original = getattr(server, name)
+        setattr(server, name, value)
+        self.addCleanup(setattr, server, name, original)
+
+    async def wait_until(self, condition, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not met in time")
+            await asyncio.sleep(0.02)
+
+
+class ConcurrencyTest(StubTestCase):
+    async def test_concurrent_queries_overlap(self):
+        latency, queries = 0.5, 8
+        self.use_backend(FakeAthena(latency_sec=latency))
+        lags = []
+
+        async def heartbeat():
+            while True:
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - t0 - 0.01)
+
+        beat = asyncio.create_task(heartbeat())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            server.run_readonly_query("db", f"SELECT {i} AS overlap", use_cache=False)
+            for i in range(queries)
+        ))
+        wall = time.perf_counter() - t0
+        beat.cancel()
+
+        self.assertLess(wall, latency * 1.5 + 0.5)  # not queries * latency
+        self.assertLess(max(lags), 0.25)
+
+
+class CursorTest(StubTestCase):
+    ROWS = [["n"]] + [[str(i)] for i in range(25)]
+
+    async def read_all(self, max_rows: int, n: int, **kwargs) -> tuple[list, dict]:
+        result = await server.run_readonly_query(
+            "db", "SELECT n FROM t", max_rows=max_rows, use_cache=False, typed=False, **kwargs
+        )
+        rows, meta = [r["n"] for r in result["rows"]], result["meta"]
+        while meta["cursor"]:
+            more = await server.fetch_more(meta["cursor"], n)
+            rows += [r["n"] for r in more["rows"]]
+            meta = more["meta"]
+        return rows, meta
+
+    async def test_fetch_more_pages_through_the_result(self):
+        backend = self.use_backend(FakeAthena(rows=self.ROWS))
+        for s3_min_rows in (0, 1):  # GetQueryResults, then the S3 CSV
+            with self.subTest(s3_min_rows=s3_min_rows):
+                self.patch("S3_FASTPATH_MIN_ROWS", s3_min_rows)
+                started = len(backend.queries)
+                rows, meta = await self.read_all(10, 7, limit_pushdown=False)
+                self.assertEqual(rows, [str(i) for i in range(25)])
+                self.assertFalse(meta["has_more"])
+                self.assertEqual(len(backend.queries) - started, 1)  # never re-run
+
+    async def test_headerless_results_lose_no_row_at_page_boundaries(self):
+        self.use_backend(HeaderlessAthena(rows=self.ROWS))
+        self.patch("S3_FASTPATH_MIN_ROWS", 0)
+        result = await server.run_readonly_query(
+            "db", "SHOW TABLES", max_rows=10, use_cache=False, typed=False
+        )
+        rows = [r["n"] for r in result["rows"]]
+        more = await server.fetch_more(result["meta"]["cursor"], 100)
+        rows += [r["n"] for r in more["rows"]]
+        self.assertEqual(rows, [str(i) for i in range(25)])
+
+    async def test_pushdown_keeps_cursors_up_to_the_cap(self):
+        self.use_backend(LimitedAthena(rows=self.ROWS))
+        self.patch("LIMIT_PUSHDOWN_ROWS", 18)
+        for s3_min_rows in (0, 1):
+            with self.subTest(s3_min_rows=s3_min_rows):
+                self.patch("S3_FASTPATH_MIN_ROWS", s3_min_rows)
+                rows, meta = await self.read_all(10, 5)
+                self.assertEqual(rows, [str(i) for i in range(18)])
+                self.assertEqual((meta["has_more"], meta["cursor"]), (True, None))
+
+    async def test_cursors_expire_when_idle(self):
+        self.use_backend(FakeAthena(rows=self.ROWS))
+        self.patch("S3_FASTPATH_MIN_ROWS", 0)
+        result = await server.run_readonly_query(
+            "db", "SELECT n FROM t", max_rows=5, use_cache=False, limit_pushdown=False
+        )
+        self.addCleanup(setattr, server._cursors, "idle_ttl_sec", server._cursors.idle_ttl_sec)
+        server._cursors.idle_ttl_sec = 0.0
+        await asyncio.sleep(0.01)
+        with self.assertRaises(ValueError):
+            await server.fetch_more(result["meta"]["cursor"], 5)
+
+    async def test_cursor_memory_is_bounded(self):
+        store = server._CursorStore(max_bytes=600, idle_ttl_sec=60)
+        cursors = [store.open({"query_id": str(i), "offset": 0}) for i in range(20)]
+        self.assertIsNone(store.get(cursors[0]))  # oldest evicted first
+        self.assertIsNotNone(store.get(cursors[-1]))
+        self.assertLessEqual(store._bytes, 600)
+
+
+class CancellationTest(StubTestCase):
+    def cancelled(self, backend: FakeAthena) -> list:
+        return [q for q in backend.queries.values() if q.get("cancelled")]
+
+    async def test_timeout_stops_the_query(self):
+        backend = self.use_backend(FakeAthena(latency_sec=30))
+        self.patch("DEFAULT_QUERY_TIMEOUT_SEC", 0.3)
+        before = server._metrics.snapshot().get('athena_queries_cancelled_total{reason="timeout"}', 0)
+        with self.assertRaises(TimeoutError):
+            await server.run_readonly_query("db", "SELECT 1 AS timeout", use_cache=False)
+        self.assertEqual(len(self.cancelled(backend)), 1)
+        after = server._metrics.snapshot()['athena_queries_cancelled_total{reason="timeout"}']
+        self.assertEqual(after, before + 1)
+
+    async def test_cancelled_tool_call_stops_the_query(self):
+        backend = self.use_backend(FakeAthena(latency_sec=30))
+        task = asyncio.create_task(
+            server.run_readonly_query("db", "SELECT 1 AS cancelled", use_cache=False)
+        )
+        await self.wait_until(lambda: backend.queries)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await self.wait_until(lambda: self.cancelled(backend))
+
+    async def test_shutdown_stops_inflight_queries(self):
+        backend = self.use_backend(FakeAthena(latency_sec=30))
+        job = await server.start_query("db", "SELECT 1 AS shutdown")
+        await self.wait_until(lambda: server._inflight_queries)
+        await asyncio.to_thread(server._stop_inflight_queries)
+        self.assertEqual(len(self.cancelled(backend)), 1)
+        self.assertFalse(server._inflight_queries)
+        status = await server.query_status(job["job_id"], wait_sec=5)
+        self.assertNotEqual(status["state"], "SUCCEEDED")
+
+
+if __name__ == "__main__":
+    unittest.main()